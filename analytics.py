@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from config import Config
+from database import Database
+
+DAY = 24 * 60 * 60
+CACHED_WINDOWS = 4  # Сколько окон (дней) держать в кэше между синхронизациями трафика
+
+class TrafficAnalytics:
+    """Агрегаты по истории трафика на массивах NumPy.
+
+    В снимках лежат накопительные счётчики панели, поэтому сначала считается
+    прирост между соседними снимками одного конфига (при сбросе счётчика
+    приростом считается новое значение). Все свёртки - по конфигам,
+    пользователям и дням - делаются через bincount, без циклов по строкам.
+    """
+
+    def __init__(self, emails: Sequence[str], counts: Sequence[int], buckets: Sequence[int],
+                 totals: Sequence[int], owners: Dict[str, int], bucket_seconds: int):
+        self.emails = np.asarray(emails)
+        counts = np.asarray(counts, dtype=np.int64)
+        self.buckets = np.asarray(buckets, dtype=np.int64)
+        totals = np.asarray(totals, dtype=np.int64)
+        self.bucket_seconds = bucket_seconds
+
+        # Снимки идут подряд по конфигам: counts[i] строк конфига emails[i]
+        self.config_index = np.repeat(np.arange(len(counts)), counts)
+        first = np.zeros(len(totals), dtype=bool)
+        first[(np.cumsum(counts) - counts)[counts > 0]] = True
+
+        delta = np.diff(totals, prepend=0)
+        delta = np.where(delta < 0, totals, delta)
+        delta[first] = 0
+        self.delta = delta
+
+        self.config_usage = np.bincount(self.config_index, weights=delta, minlength=len(self.emails))
+        owner_of_config = np.fromiter(
+            (owners.get(email, 0) for email in self.emails.tolist()), dtype=np.int64, count=len(self.emails)
+        )
+        self.users, user_index = np.unique(owner_of_config, return_inverse=True)
+        self.user_usage = np.bincount(user_index, weights=self.config_usage, minlength=len(self.users))
+
+    @property
+    def samples(self) -> int:
+        return len(self.delta)
+
+    @property
+    def total(self) -> int:
+        return int(self.delta.sum())
+
+    def top_users(self, n: int) -> List[Tuple[int, int]]:
+        """N пользователей с наибольшим трафиком: [(telegram_id, байт)]"""
+        usage = np.where(self.users == 0, 0, self.user_usage)
+        n = min(n, int(np.count_nonzero(usage)))
+        if n <= 0:
+            return []
+        index = np.argpartition(-usage, n - 1)[:n]
+        index = index[np.argsort(-usage[index])]
+        return [(int(self.users[i]), int(usage[i])) for i in index]
+
+    def daily_totals(self) -> List[Tuple[date, int]]:
+        """Трафик по дням (UTC)"""
+        if not self.samples:
+            return []
+        days = self.buckets * self.bucket_seconds // DAY
+        first_day = int(days.min())
+        totals = np.bincount(days - first_day, weights=self.delta)
+        return [
+            (datetime.fromtimestamp((first_day + i) * DAY, timezone.utc).date(), int(value))
+            for i, value in enumerate(totals)
+        ]
+
+    def percentiles(self, q: Sequence[float] = (50, 90, 99)) -> Dict[float, int]:
+        """Перцентили трафика на пользователя (среди пользователей с трафиком)"""
+        usage = self.user_usage[(self.user_usage > 0) & (self.users != 0)]
+        if not len(usage):
+            return {}
+        return dict(zip(q, (int(value) for value in np.percentile(usage, q))))
+
+    def growth(self, days: int = 7) -> Optional[float]:
+        """Изменение трафика за последние days дней к предыдущим days, %"""
+        series = np.array([value for _, value in self.daily_totals()], dtype=np.float64)
+        if len(series) < 2 * days:
+            return None
+        previous, last = series[-2 * days:-days].sum(), series[-days:].sum()
+        if previous == 0:
+            return None
+        return (last - previous) / previous * 100
+
+def _columns(emails: List[str], counts: List[int], rows: Iterable[Tuple[int, int]]) -> tuple:
+    """Заполнение массивов прямо из курсора, без промежуточного списка кортежей"""
+    data = np.fromiter(rows, dtype=[("bucket", np.int64), ("total", np.int64)], count=sum(counts))
+    return emails, counts, np.ascontiguousarray(data["bucket"]), np.ascontiguousarray(data["total"])
+
+async def load_analytics(db: Database, days: int) -> TrafficAnalytics:
+    """Загрузка снимков за days дней и расчёт агрегатов в пуле потоков"""
+    since = int((time.time() - days * DAY) // Config.TRAFFIC_BUCKET_SECONDS)
+    emails, counts, buckets, totals = await db.get_traffic_samples(since, _columns)
+    owners = await db.get_config_owners()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, TrafficAnalytics, emails, counts, buckets, totals, owners, Config.TRAFFIC_BUCKET_SECONDS
+    )
+
+class AnalyticsCache:
+    """Последние агрегаты по окнам; новые снимки появляются только при синхронизации
+    трафика, поэтому до следующей синхронизации /top и /traffic не читают БД"""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._results: "OrderedDict[int, Tuple[Optional[float], TrafficAnalytics]]" = OrderedDict()
+
+    async def get(self, days: int, synced_at: Optional[float]) -> TrafficAnalytics:
+        cached = self._results.get(days)
+        if cached is not None and cached[0] == synced_at:
+            self._results.move_to_end(days)
+            return cached[1]
+        analytics = await load_analytics(self.db, days)
+        self._results[days] = (synced_at, analytics)
+        self._results.move_to_end(days)
+        if len(self._results) > CACHED_WINDOWS:
+            self._results.popitem(last=False)
+        return analytics
@@ -0,0 +1,63 @@
+import asyncio
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PREFIX = "vpnbot_backup_"
+
+def create_backup(db_path: str = Config.DB_PATH, backup_dir: str = Config.BACKUP_DIR,
+                  compress: bool = Config.BACKUP_COMPRESS, keep: int = Config.BACKUP_KEEP) -> str:
+    """Согласованная копия работающей БД через SQLite backup API.
+
+    Копия снимается за один шаг: пошаговое копирование начинается заново
+    после каждого коммита писателя бота и под нагрузкой может не закончиться,
+    а в режиме WAL чтение писателя и так не блокирует. Блокирующая функция -
+    вызывайте через create_backup_async.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    backup_file = os.path.join(backup_dir, f"{BACKUP_PREFIX}{timestamp}.db")
+
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(backup_file)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+    if compress:
+        with open(backup_file, "rb") as src, gzip.open(f"{backup_file}.gz", "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(backup_file)
+        backup_file = f"{backup_file}.gz"
+
+    rotate_backups(backup_dir, keep)
+    logger.info(f"Backup created: {backup_file}")
+    return backup_file
+
+def rotate_backups(backup_dir: str, keep: int) -> None:
+    """Удаление старых копий, остаются keep последних"""
+    if keep <= 0:
+        return
+    backups = sorted(glob.glob(os.path.join(backup_dir, f"{BACKUP_PREFIX}*.db*")))
+    for old in backups[:-keep]:
+        try:
+            os.remove(old)
+        except OSError as e:
+            logger.warning(f"Не удалось удалить старый бэкап {old}: {str(e)}")
+
+_backup_lock = asyncio.Lock()
+
+async def create_backup_async(**kwargs) -> str:
+    """Создание бэкапа в рабочем потоке; параллельные вызовы выполняются по очереди"""
+    async with _backup_lock:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: create_backup(**kwargs))
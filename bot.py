@@ -1,6 +1,11 @@
+import asyncio
 import logging
+import os
 import random
+from pathlib import Path
+from typing import Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -9,9 +14,22 @@ from telegram.ext import (
     MessageHandler,
     filters
 )
+from backup import create_backup_async
+from broadcast import Broadcaster
 from config import Config
 from database import Database
-from xui_client import XUIClient, XUIError
+from expiry import ExpiryReaper
+from health import SpeedTest, format_probe_report, probe_ports
+from http_server import HTTPServer, Request, Response
+from jobs import JOB_DELETE, PanelJobQueue
+from nodes import NodePool
+from perf import StartupTimer, metrics
+from qr import QRError, QRRenderer
+from reconcile import Reconciler, format_report
+from singleflight import SingleFlight
+from subscription import SubscriptionService
+from traffic import TrafficMonitor, format_bytes
+from xui_client import XUIError, XUIUnavailable
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,14 +37,81 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024  # Лимит Bot API на отправку файлов
+# Имена замеров inline-кнопок: действия с параметром после "_" и кнопки без параметра
+PARAM_ACTIONS = ("delete", "confirm", "view", "cfgs", "users", "user")
+CALLBACK_ACTIONS = ("create", "list", "help", "subscription", "donate", "admin", "full_stats", "cancel")
+
 class VPNBot:
     def __init__(self):
-        self.db = Database()
-        self.xui = XUIClient()
-        self.app = Application.builder().token(Config.TOKEN).build()
+        self.startup = StartupTimer()
+        with self.startup.phase("db"):
+            self.db = Database()
+        self.nodes = NodePool()
+        self.qr = QRRenderer()
+        self.speedtest = SpeedTest()
+        with self.startup.phase("app"):
+            self.app = (
+                Application.builder()
+                .token(Config.TOKEN)
+                .base_url(Config.TELEGRAM_BASE_URL)
+                .concurrent_updates(Config.CONCURRENT_UPDATES)
+                .post_init(self._post_init)
+                .post_shutdown(self._post_shutdown)
+                .build()
+            )
+        self._warmup_task: Optional[asyncio.Task] = None
+        self._analytics = None  # AnalyticsCache, создаётся при первой команде аналитики
+        self.broadcaster = Broadcaster(self.app.bot, self.db)
+        self.jobs = PanelJobQueue(self.db, self.nodes, self._on_job_finished)
+        self.flights = SingleFlight()
+        self.traffic = TrafficMonitor(self.db, self.nodes)
+        self.expiry = ExpiryReaper(self.app.bot, self.db, self.nodes)
+        self.reconciler = Reconciler(self.db, self.nodes)
+        self.subscriptions = SubscriptionService(self.db)
+        self.http = HTTPServer(Config.HTTP_LISTEN, Config.HTTP_PORT)
+        self.http.route("/sub/", self.subscriptions.handle)
+        self.http.route("/metrics", self._metrics)
         self._register_handlers()
         self.app.add_error_handler(self._error_handler)
 
+    async def _post_init(self, application: Application) -> None:
+        """Действия после запуска приложения"""
+        if Config.XUI_WARMUP:
+            self._warmup_task = asyncio.create_task(self.nodes.warm_up())
+        with self.startup.phase("nodes"):
+            await self.nodes.load(self.db)
+        with self.startup.phase("jobs"):
+            await self.jobs.start()
+        with self.startup.phase("traffic"):
+            await self.traffic.start()
+        self.expiry.start()
+        self.reconciler.start()
+        if Config.SUBSCRIPTION_ENABLED:
+            with self.startup.phase("subscriptions"):
+                await self.subscriptions.warm_up()
+        if Config.SUBSCRIPTION_ENABLED or Config.PERF_METRICS_ENABLED:
+            await self.http.start()
+        with self.startup.phase("broadcasts"):
+            await self.broadcaster.resume()
+        logger.info(f"Startup: {self.startup.summary()}")
+
+    async def _post_shutdown(self, application: Application) -> None:
+        """Освобождение ресурсов при остановке"""
+        if self._warmup_task:
+            self._warmup_task.cancel()
+            await asyncio.gather(self._warmup_task, return_exceptions=True)
+        await self.broadcaster.stop()
+        await self.jobs.stop()
+        await self.traffic.stop()
+        await self.expiry.stop()
+        await self.reconciler.stop()
+        await self.http.stop()
+        await self.subscriptions.stop()
+        self.qr.shutdown()
+        await self.nodes.close()
+        await self.db.close()
+
     def _register_handlers(self):
         """Регистрация обработчиков команд"""
         handlers = [
@@ -34,8 +119,14 @@ class VPNBot:
             CommandHandler("help", self._show_help),
             CallbackQueryHandler(self._callback_handler),
             CommandHandler("stats", self._stats),
+            CommandHandler("top", self._top),
+            CommandHandler("traffic", self._traffic),
             CommandHandler("speedtest", self._speedtest),
+            CommandHandler("probe", self._probe),
             CommandHandler("backup", self._backup),
+            CommandHandler("reconcile", self._reconcile),
+            CommandHandler("perf", self._perf),
+            CommandHandler("users", self._users),
             MessageHandler(filters.TEXT & ~filters.COMMAND, self._handle_message)
         ]
         for handler in handlers:
@@ -46,7 +137,9 @@ class VPNBot:
         logger.error(f"Exception while handling update: {context.error}", exc_info=context.error)
         
         error_text = "❌ Произошла ошибка. Пожалуйста, попробуйте позже."
-        if isinstance(context.error, XUIError):
+        if isinstance(context.error, XUIUnavailable):
+            error_text = f"⏳ {str(context.error)}"
+        elif isinstance(context.error, XUIError):
             error_text = f"❌ Ошибка сервера: {str(context.error)}"
         
         try:
@@ -60,8 +153,8 @@ class VPNBot:
     async def _start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка команды /start"""
         user = update.effective_user
-        if not self.db.get_user(user.id):
-            self.db.add_user({
+        if not await self.db.get_user(user.id):
+            await self.db.add_user({
                 "id": user.id,
                 "username": user.username,
                 "full_name": user.full_name
@@ -146,24 +239,38 @@ class VPNBot:
         except Exception as e:
             logger.warning(f"Не удалось удалить сообщение: {str(e)}")
         
-        if query.data == "create":
-            await self._create_config(query)
-        elif query.data == "list":
-            await self._list_configs(query)
-        elif query.data == "help":
-            await self._show_help_callback(query)
-        elif query.data.startswith("delete_"):
-            await self._confirm_delete(query, query.data[7:])
-        elif query.data.startswith("confirm_"):
-            await self._delete_config(query, query.data[8:])
-        elif query.data.startswith("view_"):
-            await self._show_config_details(query, query.data[5:])
-        elif query.data == "donate":
-            await self._show_donate_info(query)
-        elif query.data == "admin":
-            await self._show_admin_panel(query)
-        elif query.data == "cancel":
-            await self._show_main_menu(update, is_admin=(query.from_user.id in Config.ADMIN_IDS))
+        action = query.data.split("_", 1)[0]
+        if action not in PARAM_ACTIONS:
+            action = query.data if query.data in CALLBACK_ACTIONS else "unknown"
+        with metrics.timer(f"callback.{action}"):
+            if query.data == "create":
+                await self._create_config(query)
+            elif query.data == "list":
+                await self._list_configs(query)
+            elif query.data == "help":
+                await self._show_help_callback(query)
+            elif query.data.startswith("delete_"):
+                await self._confirm_delete(query, query.data[7:])
+            elif query.data.startswith("confirm_"):
+                await self._delete_config(query, query.data[8:])
+            elif query.data.startswith("view_"):
+                await self._show_config_details(query, query.data[5:])
+            elif query.data.startswith("cfgs_"):
+                await self._list_configs(query, *self._page_cursor(query.data[5:]))
+            elif query.data == "users" or query.data.startswith("users_"):
+                await self._list_users(query.message, query.from_user.id, *self._page_cursor(query.data[6:]))
+            elif query.data.startswith("user_"):
+                await self._show_user(query, query.data[5:])
+            elif query.data == "subscription":
+                await self._show_subscription(query)
+            elif query.data == "donate":
+                await self._show_donate_info(query)
+            elif query.data == "admin":
+                await self._show_admin_panel(query)
+            elif query.data == "full_stats":
+                await self._show_full_stats(query)
+            elif query.data == "cancel":
+                await self._show_main_menu(update, is_admin=(query.from_user.id in Config.ADMIN_IDS))
 
     async def _show_help_callback(self, query):
         """Показать инструкции по установке (для callback)"""
@@ -227,11 +334,20 @@ class VPNBot:
             ])
         )
 
+    @staticmethod
+    def _idempotency_key(query) -> str:
+        """Ключ повторного нажатия: та же кнопка того же сообщения"""
+        return f"{query.data}:{query.message.chat_id}:{query.message.message_id}"
+
     async def _create_config(self, query):
-        """Создание нового конфига"""
-        user_id = query.from_user.id
-        current_count = self.db.count_user_configs(user_id)
-        if current_count >= Config.MAX_CONFIGS_PER_USER:
+        """Постановка создания конфига в очередь (двойное нажатие не создаёт второй)"""
+        await self.flights.do(("create", query.from_user.id), lambda: self._enqueue_create(query))
+
+    async def _enqueue_create(self, query):
+        job_id, created = await self.jobs.enqueue_create(
+            query.from_user.id, query.message.chat_id, self._idempotency_key(query)
+        )
+        if job_id is None:
             await query.message.reply_text(
                 f"❌ Достигнут лимит {Config.MAX_CONFIGS_PER_USER} конфигов!",
                 reply_markup=InlineKeyboardMarkup([
@@ -239,51 +355,132 @@ class VPNBot:
                 ])
             )
             return
+        if not created:
+            await query.message.reply_text("⏳ Конфиг уже создаётся, пришлю его, как только будет готов")
+            return
         
-        try:
-            port = random.randint(*Config.PORT_RANGE)
-            config = await self.xui.create_inbound(port)
-            config_id = self.db.create_config(user_id, config)
-            
-            remaining = Config.MAX_CONFIGS_PER_USER - current_count - 1
-            
-            config_text = (
-                f"✅ Конфиг успешно создан!\n\n"
-                f"🔹 Порт: <code>{port}</code>\n"
-                f"🔹 ID: <code>{config['uuid']}</code>\n"
-                f"🔹 Имя: <code>{config['email']}</code>\n"
-                f"🔹 Осталось конфигов: {remaining}\n\n"
-                f"<b>Ссылка для подключения:</b>\n"
-                f"<code>{config['data']}</code>\n\n"
-                f"<b>Параметры для ручного ввода:</b>\n"
-                f"Адрес: <code>{Config.SERVER_IP}</code>\n"
-                f"Порт: <code>{port}</code>\n"
-                f"ID: <code>{config['uuid']}</code>\n"
-                f"Ключ: <code>{Config.PUBLIC_KEY}</code>\n"
-                f"SNI: <code>{random.choice(Config.SERVER_NAMES)}</code>\n"
-                f"Short ID: <code>{Config.SHORT_ID}</code>"
-            )
-            
-            await query.message.reply_photo(
-                photo=config['qr_code'],
-                caption=config_text,
-                parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔙 Главное меню", callback_data="cancel")]
-                ])
-            )
-        except XUIError as e:
-            logger.error(f"Ошибка создания конфига: {str(e)}")
-            await query.message.reply_text(
-                "❌ Ошибка при создании конфига. Попробуйте позже.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔙 Главное меню", callback_data="cancel")]
-                ])
+        placeholder = await query.message.reply_text("⏳ Создаю конфиг...")
+        await self.jobs.submit(job_id, placeholder.chat_id, placeholder.message_id)
+
+    def _config_params(self, config) -> str:
+        """Ссылка и параметры для ручного ввода"""
+        node = self.nodes.get(config["node"])
+        return (
+            f"<b>Ссылка для подключения:</b>\n"
+            f"<code>{config['data']}</code>\n\n"
+            f"<b>Параметры для ручного ввода:</b>\n"
+            f"Адрес: <code>{node.server_ip}</code>\n"
+            f"Порт: <code>{config['port']}</code>\n"
+            f"ID: <code>{config['uuid']}</code>\n"
+            f"Ключ: <code>{node.public_key}</code>\n"
+            f"SNI: <code>{random.choice(node.server_names)}</code>\n"
+            f"Short ID: <code>{node.short_id}</code>"
+        )
+
+    async def _on_job_finished(self, job, result: str, error: str) -> None:
+        """Ответ пользователю по завершении задачи: правка сообщения-заглушки"""
+        chat_id, message_id = job["chat_id"], job["message_id"]
+        menu = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔙 Главное меню", callback_data="cancel")]
+        ])
+        if error:
+            await self._edit_or_send(chat_id, message_id, error, menu)
+            return
+
+        remaining = Config.MAX_CONFIGS_PER_USER - await self.db.count_user_configs(job["user_id"])
+        if job["kind"] == JOB_DELETE:
+            await self._edit_or_send(
+                chat_id, message_id,
+                f"✅ Конфиг успешно удален!\n"
+                f"🔹 Осталось конфигов: {remaining}",
+                menu
             )
+            return
+
+        config = await self.db.get_config(result)
+        config_text = (
+            f"✅ Конфиг успешно создан!\n\n"
+            f"🔹 Порт: <code>{config['port']}</code>\n"
+            f"🔹 ID: <code>{config['uuid']}</code>\n"
+            f"🔹 Имя: <code>{config['email']}</code>\n"
+            f"🔹 Осталось конфигов: {remaining}\n\n"
+            f"{self._config_params(config)}"
+        )
+        # Фото нельзя подставить в текстовое сообщение, поэтому заглушка заменяется новым
+        if message_id:
+            try:
+                await self.app.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            except BadRequest:
+                pass
+        await self._reply_config(chat_id, result, config["data"], config_text, menu)
+
+    async def _edit_or_send(self, chat_id: int, message_id: int, text: str,
+                            reply_markup: InlineKeyboardMarkup) -> None:
+        if message_id:
+            try:
+                await self.app.bot.edit_message_text(
+                    chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup
+                )
+                return
+            except BadRequest:
+                pass
+        await self.app.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+
+    async def _reply_config(self, chat_id: int, config_id: str, link: str, caption: str,
+                            reply_markup: InlineKeyboardMarkup, file_id: str = None):
+        """Отправка конфига с QR-кодом: из кэша file_id Telegram или с генерацией в пуле"""
+        bot = self.app.bot
+        if file_id:
+            try:
+                await bot.send_photo(
+                    chat_id=chat_id,
+                    photo=file_id,
+                    caption=caption,
+                    parse_mode="HTML",
+                    reply_markup=reply_markup
+                )
+                return
+            except BadRequest as e:
+                logger.warning(f"file_id QR-кода {config_id} недействителен: {str(e)}")
+        
+        try:
+            qr_code = await self.qr.render(link)
+        except QRError:
+            await bot.send_message(chat_id=chat_id, text=caption, parse_mode="HTML", reply_markup=reply_markup)
+            return
+        
+        message = await bot.send_photo(
+            chat_id=chat_id,
+            photo=qr_code,
+            caption=caption,
+            parse_mode="HTML",
+            reply_markup=reply_markup
+        )
+        if message.photo:
+            await self.db.set_qr_file_id(config_id, message.photo[-1].file_id)
+
+    @staticmethod
+    def _page_cursor(cursor: str):
+        """Курсор страницы из callback_data: ">ключ" - после ключа, "<ключ" - до него"""
+        if cursor[:1] == ">":
+            return cursor[1:], None
+        if cursor[:1] == "<":
+            return None, cursor[1:]
+        return None, None
 
-    async def _list_configs(self, query):
-        """Список конфигов пользователя"""
-        configs = self.db.get_user_configs(query.from_user.id)
+    @staticmethod
+    def _page_buttons(prefix: str, rows, has_prev: bool, has_next: bool, key: str = "id"):
+        """Кнопки «назад/далее» для страницы списка"""
+        buttons = []
+        if has_prev:
+            buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"{prefix}<{rows[0][key]}"))
+        if has_next:
+            buttons.append(InlineKeyboardButton("Далее ➡️", callback_data=f"{prefix}>{rows[-1][key]}"))
+        return [buttons] if buttons else []
+
+    async def _list_configs(self, query, after: str = None, before: str = None):
+        """Список конфигов пользователя постранично"""
+        configs, has_prev, has_next = await self.db.get_user_configs_page(query.from_user.id, after, before)
         if not configs:
             await query.message.reply_text(
                 "У вас нет активных конфигов",
@@ -300,7 +497,10 @@ class VPNBot:
                 InlineKeyboardButton(f"👁 {config['email']}", callback_data=f"view_{config['id']}"),
                 InlineKeyboardButton("❌ Удалить", callback_data=f"delete_{config['id']}")
             ])
+        buttons.extend(self._page_buttons("cfgs_", configs, has_prev, has_next))
         
+        if Config.SUBSCRIPTION_ENABLED:
+            buttons.append([InlineKeyboardButton("🔗 Подписка на все конфиги", callback_data="subscription")])
         buttons.append([InlineKeyboardButton("🔙 Главное меню", callback_data="cancel")])
         
         await query.message.reply_text(
@@ -310,10 +510,7 @@ class VPNBot:
 
     async def _show_config_details(self, query, config_id):
         """Показать детали конфига с QR-кодом"""
-        config = self.db.conn.execute(
-            "SELECT * FROM configs WHERE id = ? AND is_active = 1",
-            (config_id,)
-        ).fetchone()
+        config = await self.db.get_user_config(query.from_user.id, config_id)
         
         if not config:
             await query.message.reply_text(
@@ -325,26 +522,39 @@ class VPNBot:
             )
             return
         
-        qr_code = self.xui._generate_qr_code(config['data'])
-        
+        usage = self.traffic.config_usage(config["email"])
         config_text = (
             f"🔹 Конфиг: <code>{config['email']}</code>\n"
             f"🔹 Порт: <code>{config['port']}</code>\n"
-            f"🔹 ID: <code>{config['uuid']}</code>\n\n"
-            f"<b>Ссылка для подключения:</b>\n"
-            f"<code>{config['data']}</code>\n\n"
-            f"<b>Параметры для ручного ввода:</b>\n"
-            f"Адрес: <code>{Config.SERVER_IP}</code>\n"
-            f"Порт: <code>{config['port']}</code>\n"
-            f"ID: <code>{config['uuid']}</code>\n"
-            f"Ключ: <code>{Config.PUBLIC_KEY}</code>\n"
-            f"SNI: <code>{random.choice(Config.SERVER_NAMES)}</code>\n"
-            f"Short ID: <code>{Config.SHORT_ID}</code>"
+            f"🔹 ID: <code>{config['uuid']}</code>\n"
+            f"🔹 Трафик: {usage or 'нет данных'}\n"
+            f"🔹 Действует до: {config['expires_at'] + ' UTC' if config['expires_at'] else 'бессрочно'}\n\n"
+            f"{self._config_params(config)}"
         )
         
-        await query.message.reply_photo(
-            photo=qr_code,
-            caption=config_text,
+        await self._reply_config(
+            query.message.chat_id,
+            config_id,
+            config['data'],
+            config_text,
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("🗂 Мои конфиги", callback_data="list")],
+                [InlineKeyboardButton("🔙 Главное меню", callback_data="cancel")]
+            ]),
+            file_id=config['qr_file_id']
+        )
+
+    async def _show_subscription(self, query):
+        """Ссылка подписки со всеми активными конфигами пользователя"""
+        if not Config.SUBSCRIPTION_ENABLED:
+            return
+        
+        token = await self.subscriptions.token_for(query.from_user.id)
+        await query.message.reply_text(
+            f"🔗 <b>Ссылка подписки:</b>\n"
+            f"<code>{self.subscriptions.url(token)}</code>\n\n"
+            f"Добавьте её в клиент (например, V2RayTun) как подписку - "
+            f"все ваши конфиги появятся и будут обновляться автоматически.",
             parse_mode="HTML",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("🗂 Мои конфиги", callback_data="list")],
@@ -377,134 +587,372 @@ class VPNBot:
         )
 
     async def _delete_config(self, query, config_id):
-        """Удаление конфига"""
-        try:
-            configs = self.db.get_user_configs(query.from_user.id)
-            target_config = next((c for c in configs if c["id"] == config_id), None)
-            
-            if not target_config:
-                await query.message.reply_text("Конфиг не найден!")
-                return
-            
-            success = await self.xui.delete_inbound(target_config["inbound_id"])
-            if success:
-                self.db.delete_config(config_id)
-                remaining = Config.MAX_CONFIGS_PER_USER - self.db.count_user_configs(query.from_user.id)
-                
-                await query.message.reply_text(
-                    f"✅ Конфиг успешно удален!\n"
-                    f"🔹 Осталось конфигов: {remaining}",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🔙 Главное меню", callback_data="cancel")]
-                    ])
-                )
-            else:
-                await query.message.reply_text(
-                    "❌ Не удалось удалить конфиг",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🔙 Главное меню", callback_data="cancel")]
-                    ])
-                )
-        except XUIError as e:
-            logger.error(f"Ошибка удаления конфига: {str(e)}")
-            await query.message.reply_text(
-                "⚠️ Ошибка сервера при удалении",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔙 Главное меню", callback_data="cancel")]
-                ])
-            )
+        """Постановка удаления конфига в очередь"""
+        await self.flights.do(
+            ("delete", query.from_user.id, config_id),
+            lambda: self._enqueue_delete(query, config_id)
+        )
+
+    async def _enqueue_delete(self, query, config_id):
+        if not await self.db.get_user_config(query.from_user.id, config_id):
+            await query.message.reply_text("Конфиг не найден!")
+            return
+        
+        job_id, created = await self.jobs.enqueue_delete(
+            query.from_user.id, config_id, query.message.chat_id, self._idempotency_key(query)
+        )
+        if not created:
+            await query.message.reply_text("⏳ Конфиг уже удаляется, сообщу, когда будет готово")
+            return
+        
+        placeholder = await query.message.reply_text("⏳ Удаляю конфиг...")
+        await self.jobs.submit(job_id, placeholder.chat_id, placeholder.message_id)
 
     async def _show_admin_panel(self, query):
         """Панель администратора"""
-        stats = self.db.get_detailed_stats()
-        total_users = len(self.db.conn.execute("SELECT id FROM users").fetchall())
-        active_configs = len(self.db.conn.execute(
-            "SELECT id FROM configs WHERE is_active = 1"
-        ).fetchall())
+        if query.from_user.id not in Config.ADMIN_IDS:
+            return
+        
+        stats = await self.db.get_detailed_stats(days=5)
+        total_users = await self.db.count_users()
+        active_configs = await self.db.count_active_configs()
+        age = self.traffic.age
+        traffic_age = f" (обновлено {age / 60:.0f} мин назад)" if age is not None else " (ещё не загружен)"
         
         await query.message.reply_text(
             f"👑 Админ-панель\n\n"
             f"👥 Пользователей: {total_users}\n"
             f"🔗 Активных конфигов: {active_configs}\n\n"
-            f"Последние регистрации:\n" + "\n".join(
+            "🖥 Ноды:\n" + "\n".join(self.nodes.status_lines()) + "\n\n"
+            f"📶 Трафик{traffic_age}:\n" + "\n".join(self.traffic.node_lines()) + "\n\n"
+            "Последние регистрации:\n" + "\n".join(
                 f"{row['date']}: {row['new_users']} новых"
-                for row in stats[:5]
+                for row in stats
             ),
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("📊 Полная статистика", callback_data="full_stats")],
+                [InlineKeyboardButton("👥 Пользователи", callback_data="users")],
                 [InlineKeyboardButton("🔙 Главное меню", callback_data="cancel")]
             ])
         )
 
+    @staticmethod
+    def _user_label(user) -> str:
+        return f"@{user['username']}" if user["username"] else (user["full_name"] or str(user["telegram_id"]))
+
+    def _users_keyboard(self, users, extra_rows=()) -> InlineKeyboardMarkup:
+        buttons = [
+            [InlineKeyboardButton(f"👤 {self._user_label(user)}", callback_data=f"user_{user['telegram_id']}")]
+            for user in users
+        ]
+        buttons.extend(extra_rows)
+        buttons.append([InlineKeyboardButton("🔙 Админ-панель", callback_data="admin")])
+        return InlineKeyboardMarkup(buttons)
+
+    async def _list_users(self, message, admin_id: int, after: str = None, before: str = None):
+        """Постраничный список пользователей для админов"""
+        if admin_id not in Config.ADMIN_IDS:
+            return
+        
+        try:
+            after = int(after) if after is not None else None
+            before = int(before) if before is not None else None
+        except ValueError:
+            after = before = None
+        users, has_prev, has_next = await self.db.get_users_page(after, before)
+        await message.reply_text(
+            f"👥 Пользователи (всего {await self.db.count_users()}).\n"
+            f"Поиск: /users <telegram_id или @username>",
+            reply_markup=self._users_keyboard(users, self._page_buttons("users_", users, has_prev, has_next))
+        )
+
+    async def _users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Браузер пользователей. /users - список, /users <telegram_id|@username> - поиск"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
+        
+        if not context.args:
+            await self._list_users(update.message, update.effective_user.id)
+            return
+        
+        users = await self.db.search_users(context.args[0])
+        if not users:
+            await update.message.reply_text("Никого не нашлось")
+            return
+        await update.message.reply_text(
+            f"🔍 Найдено: {len(users)}" + (" (уточните запрос, показаны первые)" if len(users) >= Config.LIST_PAGE_SIZE else ""),
+            reply_markup=self._users_keyboard(users)
+        )
+
+    async def _show_user(self, query, telegram_id: str):
+        """Карточка пользователя для админов"""
+        if query.from_user.id not in Config.ADMIN_IDS or not telegram_id.isdigit():
+            return
+        
+        user = await self.db.get_user(int(telegram_id))
+        if not user:
+            await query.message.reply_text("Пользователь не найден")
+            return
+        
+        configs, _, has_more = await self.db.get_user_configs_page(user["telegram_id"])
+        lines = [
+            f"👤 {user['full_name'] or '—'}",
+            f"Username: {'@' + user['username'] if user['username'] else '—'}",
+            f"Telegram ID: {user['telegram_id']}",
+            f"Регистрация: {user['created_at']} UTC",
+            "",
+            "🔗 Активные конфиги:" if configs else "Активных конфигов нет",
+        ]
+        for config in configs:
+            usage = self.traffic.config_usage(config["email"])
+            lines.append(f"• {config['email']} ({config['node']}, порт {config['port']})" + (f" — {usage}" if usage else ""))
+        if has_more:
+            lines.append("…")
+        await query.message.reply_text(
+            "\n".join(lines),
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("👥 Пользователи", callback_data="users")],
+                [InlineKeyboardButton("🔙 Админ-панель", callback_data="admin")]
+            ])
+        )
+
     async def _stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Статистика для админов"""
         if update.effective_user.id not in Config.ADMIN_IDS:
             return
         
-        stats = self.db.get_detailed_stats()
+        await update.message.reply_text(await self._format_stats())
+
+    async def _show_full_stats(self, query):
+        """Полная статистика (из админ-панели)"""
+        if query.from_user.id not in Config.ADMIN_IDS:
+            return
+        
+        await query.message.reply_text(
+            await self._format_stats(),
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("👑 Админ-панель", callback_data="admin")],
+                [InlineKeyboardButton("🔙 Главное меню", callback_data="cancel")]
+            ])
+        )
+
+    async def _format_stats(self) -> str:
+        stats = await self.db.get_detailed_stats()
         response = ["📊 Статистика за 30 дней:\nДата | Новые пользователи"]
         response.extend(f"{row['date']} | {row['new_users']}" for row in stats)
+        return "\n".join(response)
+
+    @staticmethod
+    def _int_args(context: ContextTypes.DEFAULT_TYPE, *defaults: int) -> list:
+        """Числовые аргументы команды с подстановкой значений по умолчанию"""
+        args = context.args or []
+        values = []
+        for i, default in enumerate(defaults):
+            try:
+                values.append(max(int(args[i]), 1))
+            except (IndexError, ValueError):
+                values.append(default)
+        return values
+
+    async def _load_analytics(self, update: Update, days: int):
+        """Аналитика трафика; NumPy импортируется при первой команде, а не при старте"""
+        if self._analytics is None:
+            try:
+                from analytics import AnalyticsCache
+            except ImportError:
+                await update.message.reply_text("❌ Для аналитики трафика нужен NumPy (pip install numpy)")
+                return None
+            self._analytics = AnalyticsCache(self.db)
+        return await self._analytics.get(days, self.traffic.updated_at)
+
+    async def _top(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Пользователи с наибольшим трафиком. /top [N] [дней]"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
         
-        await update.message.reply_text("\n".join(response))
+        n, days = self._int_args(context, 20, 7)
+        analytics = await self._load_analytics(update, days)
+        if analytics is None:
+            return
+        top = analytics.top_users(n)
+        if not top:
+            await update.message.reply_text(f"Нет данных о трафике за {days} дн.")
+            return
+        
+        usernames = await self.db.get_usernames([user_id for user_id, _ in top])
+        lines = [f"🏆 Топ-{len(top)} по трафику за {days} дн.:"]
+        for place, (user_id, used) in enumerate(top, 1):
+            name = f"@{usernames[user_id]}" if usernames.get(user_id) else str(user_id)
+            lines.append(f"{place}. {name} — {format_bytes(used)}")
+        await update.message.reply_text("\n".join(lines))
+
+    async def _traffic(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Трафик по дням, перцентили и динамика. /traffic [дней]"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
+        
+        days, = self._int_args(context, 14)
+        analytics = await self._load_analytics(update, days)
+        if analytics is None:
+            return
+        if not analytics.samples:
+            await update.message.reply_text(f"Нет данных о трафике за {days} дн.")
+            return
+        
+        lines = [f"📶 Трафик за {days} дн.: {format_bytes(analytics.total)}", "", "По дням:"]
+        lines.extend(f"{day:%d.%m} | {format_bytes(used)}" for day, used in analytics.daily_totals())
+        percentiles = analytics.percentiles()
+        if percentiles:
+            lines.append("")
+            lines.append("На пользователя: " + ", ".join(
+                f"p{q:g} {format_bytes(value)}" for q, value in percentiles.items()
+            ))
+        growth = analytics.growth()
+        if growth is not None:
+            lines.append(f"Неделя к неделе: {growth:+.0f}%")
+        await update.message.reply_text("\n".join(lines))
 
     async def _speedtest(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Тест скорости сервера"""
-        try:
-            import speedtest
-            st = speedtest.Speedtest()
-            st.get_best_server()
-            speed = st.download() / 1_000_000  # Мбит/с
-            
-            await update.message.reply_text(
-                f"📶 Скорость подключения: {speed:.2f} Мбит/с\n"
-                f"🏠 Сервер: {st.results.server['name']}"
+        """Тест скорости сервера (в фоне, с кэшем последнего результата)"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
+        
+        lines = []
+        result = self.speedtest.last_result
+        if result:
+            lines.append(
+                f"📶 Последний замер ({result['measured_at']:%d.%m %H:%M}): {result['speed']:.2f} Мбит/с\n"
+                f"🏠 Сервер: {result['server']}"
             )
-        except ImportError:
-            await update.message.reply_text("❌ Модуль speedtest-cli не установлен")
-        except Exception as e:
-            await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+        
+        chat_id = update.effective_chat.id
+        
+        async def report():
+            if self.speedtest.last_error:
+                text = f"❌ Ошибка: {self.speedtest.last_error}"
+            else:
+                result = self.speedtest.last_result
+                text = f"📶 Скорость подключения: {result['speed']:.2f} Мбит/с\n🏠 Сервер: {result['server']}"
+            await self.app.bot.send_message(chat_id=chat_id, text=text)
+        
+        if self.speedtest.start(on_done=report):
+            lines.append("⏳ Новый замер запущен, результат придёт отдельным сообщением")
+        else:
+            lines.append("⏳ Замер уже выполняется")
+        await update.message.reply_text("\n\n".join(lines))
+
+    async def _probe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Проверка доступности портов всех активных конфигов"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
+        
+        for name, node in self.nodes.clients.items():
+            ports = await self.db.get_used_ports(name)
+            if not ports:
+                await update.message.reply_text(f"Нода {name}: нет активных конфигов для проверки")
+                continue
+            
+            await update.message.reply_text(f"⏳ Нода {name}: проверяю {len(ports)} портов...")
+            results = await probe_ports(node.server_ip, ports)
+            await update.message.reply_text(format_probe_report(node.server_ip, results))
 
     async def _backup(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Создание резервной копии (для админов)"""
+        """Создание резервной копии (для админов). /backup send - прислать файл"""
         if update.effective_user.id not in Config.ADMIN_IDS:
             return
         
+        send = Config.BACKUP_SEND_TO_ADMIN or "send" in (context.args or [])
         try:
-            import shutil
-            from datetime import datetime
-            
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_file = f"vpnbot_backup_{timestamp}.db"
-            
-            shutil.copy2("vpnbot.db", backup_file)
-            
+            backup_file = await create_backup_async(db_path=self.db.db_path)
             await update.message.reply_text(f"✅ Резервная копия создана: {backup_file}")
+            
+            if send:
+                if os.path.getsize(backup_file) > MAX_DOCUMENT_SIZE:
+                    await update.message.reply_text("⚠️ Файл больше 50 МБ и не может быть отправлен в Telegram")
+                    return
+                loop = asyncio.get_running_loop()
+                content = await loop.run_in_executor(None, Path(backup_file).read_bytes)
+                await update.message.reply_document(document=content, filename=os.path.basename(backup_file))
         except Exception as e:
             await update.message.reply_text(f"❌ Ошибка создания бэкапа: {str(e)}")
 
+    async def _reconcile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сверка БД с панелями. /reconcile - отчёт, /reconcile fix - исправить"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
+        
+        fix = "fix" in (context.args or [])
+        await update.message.reply_text("⏳ Сверяю конфиги с панелями...")
+        diffs = await self.reconciler.run(fix=fix)
+        await update.message.reply_text(format_report(diffs, fix))
+
+    async def _perf(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Задержки операций бота. /perf - отчёт, /perf reset - сбросить замеры"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
+        
+        if "reset" in (context.args or []):
+            metrics.reset()
+            for cache in self.db.caches.values():
+                cache.reset_stats()
+            await update.message.reply_text("✅ Замеры сброшены")
+            return
+        
+        lines = [metrics.report(), "", "🗃 Кэш БД:"]
+        for name, cache in self.db.caches.items():
+            lines.append(
+                f"{name}: {cache.hit_rate:.0%} попаданий ({cache.hits}/{cache.hits + cache.misses}), "
+                f"записей {len(cache)}/{cache.maxsize}"
+            )
+        await update.message.reply_text("\n".join(lines))
+
+    async def _metrics(self, request: Request) -> Response:
+        """Метрики в формате Prometheus"""
+        if not Config.PERF_METRICS_ENABLED:
+            return Response(404)
+        if Config.PERF_METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {Config.PERF_METRICS_TOKEN}":
+            return Response(401)
+        return Response(200, metrics.prometheus().encode(), {"Content-Type": "text/plain; version=0.0.4"})
+
     async def _handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка текстовых сообщений"""
         if update.message.text.lower() == "техработы" and update.effective_user.id in Config.ADMIN_IDS:
             await update.message.reply_text("Отправьте сообщение о техработах:")
             context.user_data["awaiting_tech_work"] = True
         elif update.effective_user.id in Config.ADMIN_IDS and context.user_data.get("awaiting_tech_work"):
-            await self.notify_tech_work(update.message.text)
-            await update.message.reply_text("✅ Уведомление отправлено")
+            broadcast_id = await self.notify_tech_work(update.message.text, update.effective_user.id)
+            await update.message.reply_text(
+                f"✅ Уведомление отправлено, рассылка #{broadcast_id} запущена. "
+                f"Отчёт придёт по завершении."
+            )
             context.user_data["awaiting_tech_work"] = False
 
-    async def notify_tech_work(self, message: str):
-        """Отправка уведомления о техработах"""
+    async def notify_tech_work(self, message: str, admin_id: int = None) -> int:
+        """Отправка уведомления о техработах в чат и рассылка всем пользователям"""
+        text = f"⚠️ Технические работы:\n{message}"
         try:
             await self.app.bot.send_message(
                 chat_id=Config.TECH_WORK_CHAT_ID,
-                text=f"⚠️ Технические работы:\n{message}"
+                text=text
             )
         except Exception as e:
             logger.error(f"Ошибка отправки уведомления: {str(e)}")
+        return await self.broadcaster.start(text, admin_id)
 
     def run(self):
         """Запуск бота"""
-        self.app.run_polling()
+        if Config.BOT_MODE == "webhook":
+            self.app.run_webhook(
+                listen=Config.WEBHOOK_LISTEN,
+                port=Config.WEBHOOK_PORT,
+                url_path=Config.WEBHOOK_PATH,
+                webhook_url=Config.WEBHOOK_URL,
+                secret_token=Config.WEBHOOK_SECRET,
+                cert=Config.WEBHOOK_CERT,
+                key=Config.WEBHOOK_KEY
+            )
+        else:
+            self.app.run_polling()
 
 if __name__ == "__main__":
     bot = VPNBot()
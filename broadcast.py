@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from config import Config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Token bucket для глобального лимита отправки сообщений"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Остановка отправки на время, указанное Telegram в ответе 429"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class Broadcaster:
+    """Рассылка сообщения всем пользователям.
+
+    Пользователи читаются из БД порциями по первичному ключу и раздаются
+    воркерам через asyncio.Queue. После каждой порции прогресс сохраняется
+    в таблицу broadcasts, поэтому прерванная рассылка продолжается с места
+    остановки после перезапуска.
+    """
+
+    def __init__(self, bot: Bot, db: Database):
+        self.bot = bot
+        self.db = db
+        self._limiter = RateLimiter(Config.BROADCAST_RATE, burst=Config.BROADCAST_WORKERS)
+        self._last_sent = {}
+        self._tasks = set()
+
+    async def start(self, text: str, admin_id: int) -> int:
+        """Создание рассылки и запуск в фоне"""
+        broadcast_id = await self.db.create_broadcast(text, admin_id)
+        self._spawn(await self.db.get_broadcast(broadcast_id))
+        return broadcast_id
+
+    async def resume(self) -> None:
+        """Продолжение рассылок, прерванных перезапуском"""
+        for broadcast in await self.db.get_unfinished_broadcasts():
+            logger.info(f"Resuming broadcast #{broadcast['id']} after user {broadcast['last_user_id']}")
+            self._spawn(broadcast)
+
+    async def stop(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _spawn(self, broadcast) -> None:
+        task = asyncio.create_task(self._run(broadcast))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, broadcast) -> None:
+        broadcast_id = broadcast["id"]
+        last_user_id = broadcast["last_user_id"]
+        sent, failed = broadcast["sent"], broadcast["failed"]
+        started = time.monotonic()
+        processed = 0
+
+        try:
+            while True:
+                users = await self.db.get_user_ids_after(last_user_id, Config.BROADCAST_CHUNK_SIZE)
+                if not users:
+                    break
+
+                queue: asyncio.Queue = asyncio.Queue()
+                for user in users:
+                    queue.put_nowait(user["telegram_id"])
+                results = await asyncio.gather(*(
+                    self._worker(queue, broadcast["text"])
+                    for _ in range(min(Config.BROADCAST_WORKERS, len(users)))
+                ))
+
+                sent += sum(ok for ok, _ in results)
+                failed += sum(bad for _, bad in results)
+                processed += len(users)
+                last_user_id = users[-1]["id"]
+                self._last_sent.clear()
+                await self.db.update_broadcast_progress(broadcast_id, last_user_id, sent, failed)
+
+            await self.db.finish_broadcast(broadcast_id)
+        except Exception as e:
+            logger.error(f"Рассылка #{broadcast_id} прервана: {str(e)}", exc_info=True)
+            return
+
+        elapsed = time.monotonic() - started
+        rate = processed / elapsed if elapsed > 0 else 0
+        logger.info(f"Broadcast #{broadcast_id} finished: sent={sent}, failed={failed}, {rate:.1f} msg/s")
+        await self._report(broadcast["admin_id"], (
+            f"📣 Рассылка #{broadcast_id} завершена\n\n"
+            f"✅ Доставлено: {sent}\n"
+            f"❌ Ошибок: {failed}\n"
+            f"⏱ Время: {elapsed:.1f} с ({rate:.1f} сообщ./с)"
+        ))
+
+    async def _worker(self, queue: asyncio.Queue, text: str) -> tuple:
+        sent = failed = 0
+        while not queue.empty():
+            chat_id = queue.get_nowait()
+            if await self._send(chat_id, text):
+                sent += 1
+            else:
+                failed += 1
+        return sent, failed
+
+    async def _send(self, chat_id: int, text: str) -> bool:
+        """Отправка одному пользователю с учётом лимитов и повторами после 429"""
+        for attempt in range(Config.BROADCAST_MAX_RETRIES + 1):
+            wait = self._last_sent.get(chat_id, 0) + Config.BROADCAST_PER_CHAT_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self._limiter.acquire()
+            self._last_sent[chat_id] = time.monotonic()
+
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                logger.warning(f"Flood limit, pausing broadcast for {delay} s")
+                self._limiter.pause(delay)
+            except (Forbidden, BadRequest):
+                # Пользователь заблокировал бота или удалил аккаунт
+                return False
+            except NetworkError as e:
+                logger.warning(f"Ошибка отправки {chat_id}: {str(e)}")
+                await asyncio.sleep(2 ** attempt)
+        return False
+
+    async def _report(self, admin_id: int, text: str) -> None:
+        if not admin_id:
+            return
+        try:
+            await self.bot.send_message(chat_id=admin_id, text=text)
+        except Exception as e:
+            logger.error(f"Не удалось отправить отчёт о рассылке: {str(e)}")
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+_MISSING = object()
+
+class LRUCache:
+    """Ограниченный LRU-кэш со счётчиками попаданий.
+
+    Значение, прочитанное из БД, кладётся через put с поколением, взятым до
+    чтения: если за это время инвалидировали этот же ключ, устаревший
+    результат не попадёт в кэш. Поколения инвалидаций хранятся по ключам
+    (последние maxsize), поэтому запись одного пользователя не мешает
+    заполнять кэш другим; для забытых ключей берётся поколение последнего
+    вытесненного - это лишь изредка отбрасывает свежее значение.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.generation = 0
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._forgotten = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """(найдено, значение); найденный ключ становится самым свежим"""
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return True, value
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        if generation is not None and self._invalidated.get(key, self._forgotten) > generation:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self.generation += 1
+        self._data.pop(key, None)
+        self._invalidated[key] = self.generation
+        self._invalidated.move_to_end(key)
+        if len(self._invalidated) > max(self.maxsize, 1):
+            _, self._forgotten = self._invalidated.popitem(last=False)
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -5,11 +5,55 @@ class Config:
     TOKEN = "YOUR_TELEGRAM_BOT_TOKEN"
     ADMIN_IDS = [123456789]  # Ваш Telegram ID
     TECH_WORK_CHAT_ID = -100123456  # Чат для уведомлений
+    CONCURRENT_UPDATES = 64  # Сколько апдейтов обрабатывается параллельно
+    TELEGRAM_BASE_URL = "https://api.telegram.org/bot"  # Адрес Bot API (свой сервер или заглушка для нагрузочных тестов)
+
+    # Webhook
+    BOT_MODE = "polling"  # "polling" или "webhook"
+    WEBHOOK_LISTEN = "0.0.0.0"
+    WEBHOOK_PORT = 8080
+    WEBHOOK_PATH = "telegram"
+    WEBHOOK_URL = "https://yourdomain.com/telegram"  # Публичный адрес, который получит Telegram
+    WEBHOOK_SECRET = None  # Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_CERT = None  # Путь к сертификату для TLS без обратного прокси
+    WEBHOOK_KEY = None  # Путь к приватному ключу сертификата
     
+    # Database
+    DB_PATH = "vpnbot.db"
+    DB_READ_POOL_SIZE = 4  # Потоков-читателей SQLite
+    DB_BATCH_SIZE = 100  # Максимум операций записи в одной транзакции
+    DB_COMMIT_DELAY = 0.0  # Сколько секунд копить записи перед коммитом (0 - только уже накопившиеся)
+    DB_CACHE_SIZE = 10000  # Пользователей и списков конфигов в кэше в памяти (0 - без кэша)
+
+    # Backup
+    BACKUP_DIR = "backups"
+    BACKUP_COMPRESS = True  # Сжимать копии в .gz
+    BACKUP_KEEP = 7  # Сколько последних копий хранить (0 - все)
+    BACKUP_SEND_TO_ADMIN = False  # Всегда присылать файл копии в ответ на /backup
+
     # 3X-UI
     XUI_URL = "http://your-xui-panel.com:54321"
     XUI_LOGIN = "admin"
     XUI_PASSWORD = "your_password"
+    XUI_SESSION_FILE = "xui_session.json"  # None - не сохранять сессию между перезапусками
+    XUI_MAX_CONNECTIONS = 20  # Размер пула HTTP-соединений к каждой панели
+    XUI_TIMEOUT = 10.0  # Таймаут запроса к панели, с
+    XUI_RETRIES = 2  # Повторы идемпотентных запросов (список, удаление)
+    XUI_RETRY_BASE_DELAY = 0.5  # Базовая задержка экспоненциального повтора, с
+    XUI_BREAKER_THRESHOLD = 5  # Ошибок подряд до размыкания circuit breaker
+    XUI_BREAKER_RESET_TIMEOUT = 30  # Через сколько секунд пробовать панель снова
+    XUI_WARMUP = True  # Входить в панели в фоне сразу после запуска, а не на первом запросе
+
+    # Nodes
+    # Несколько серверов с 3X-UI. Каждая запись переопределяет параметры выше:
+    # {"name": "de1", "url": "...", "login": "...", "password": "...", "server_ip": "...",
+    #  "public_key": "...", "private_key": "...", "short_id": "...", "weight": 1.0}
+    # Пустой список - одна нода "main" с настройками XUI_*, Reality и SERVER_IP.
+    NODES = []
+    # Имя ноды из NODES для записей, созданных до перехода на NODES (в БД они записаны как "main").
+    # При старте такие конфиги переносятся на неё; None - не переносить.
+    LEGACY_NODE = None
+    NODE_TRAFFIC_FACTOR = 0.5  # Доля трафика за 24 ч в нагрузке ноды при выборе (0 - только число конфигов)
     
     # Reality
     PUBLIC_KEY = "your_public_key"
@@ -23,8 +67,63 @@ class Config:
     
     # Limits
     MAX_CONFIGS_PER_USER = 10
+    LIST_PAGE_SIZE = 8  # Строк на странице списков конфигов и пользователей
     PORT_RANGE = (30000, 40000)
+    PORT_SYNC_WITH_PANEL = True  # При старте помечать занятыми порты всех inbound панели
     DEFAULT_FLOW = "xtls-rprx-vision"
-    DEFAULT_EXPIRE_DAYS = 0
+    DEFAULT_EXPIRE_DAYS = 0  # Срок действия конфига в днях (0 - бессрочно)
+
+    # Broadcast
+    BROADCAST_RATE = 25  # Сообщений в секунду суммарно (лимит Telegram - около 30)
+    BROADCAST_PER_CHAT_INTERVAL = 1.0  # Минимальный интервал между сообщениями в один чат, с
+    BROADCAST_WORKERS = 8  # Параллельных отправителей
+    BROADCAST_CHUNK_SIZE = 500  # Пользователей в одной порции (прогресс сохраняется после каждой)
+    BROADCAST_MAX_RETRIES = 3
+
+    # HTTP
+    HTTP_LISTEN = "0.0.0.0"  # Встроенный HTTP-сервер для подписок и метрик
+    HTTP_PORT = 8081
+
+    # Subscription
+    SUBSCRIPTION_ENABLED = False  # HTTP-эндпоинт подписки со всеми конфигами пользователя
+    SUBSCRIPTION_URL = "https://yourdomain.com/sub"  # Публичный адрес, проксируется на HTTP_PORT/sub
+    SUBSCRIPTION_UPDATE_INTERVAL = 12  # Как часто клиенту обновлять подписку, ч
+
+    # Perf
+    PERF_SLOW_THRESHOLD = 1.0  # Операции дольше этого, с, пишутся в лог
+    PERF_METRICS_ENABLED = False  # Эндпоинт /metrics в формате Prometheus на HTTP_PORT
+    PERF_METRICS_TOKEN = ""  # Если задан, /metrics требует заголовок Authorization: Bearer <токен>
+
+    # Health
+    PROBE_CONCURRENCY = 200  # Одновременных TCP-подключений при /probe
+    PROBE_TIMEOUT = 3.0  # Таймаут подключения к порту, с
+
+    # Expiry
+    EXPIRY_CHECK_INTERVAL = 3600  # Как часто искать истёкшие конфиги, с
+    EXPIRY_BATCH_SIZE = 100  # Конфигов в одной порции
+    EXPIRY_CONCURRENCY = 10  # Одновременных запросов к панели при удалении
+    EXPIRY_NOTIFY_DAYS = 3  # За сколько дней предупреждать об истечении
+
+    # Reconcile
+    RECONCILE_INTERVAL = 3600  # Как часто сверять БД с панелями, с (0 - только по /reconcile)
+    RECONCILE_AUTO_FIX = False  # Исправлять расхождения при фоновой сверке, а не только писать в лог
+
+    # Traffic
+    TRAFFIC_SYNC_INTERVAL = 300  # Как часто забирать статистику трафика с панелей, с
+    TRAFFIC_BUCKET_SECONDS = 3600  # Шаг снимков трафика в БД, с
+    TRAFFIC_RETENTION_DAYS = 30  # Сколько дней хранить снимки
+
+    # QR
+    QR_WORKERS = 2  # Размер пула для генерации QR-кодов
+    QR_USE_PROCESSES = False  # True - пул процессов вместо потоков
+
+    # Provisioning
+    PROVISIONING_MODE = "inbound"  # "inbound" - отдельный inbound на конфиг, "shared" - клиенты в общих inbound
+    SHARED_INBOUND_PORTS = [8443, 2053]  # Порты общих inbound для режима "shared"
+
+    # Jobs
+    JOB_WORKERS = 4  # Параллельных обработчиков операций с панелью
+    JOB_MAX_ATTEMPTS = 5  # Попыток выполнить операцию, прежде чем сообщить об ошибке
+    JOB_RETRY_BASE_DELAY = 2.0  # Базовая задержка повтора, с (удваивается с каждой попыткой)
 
 config = Config()
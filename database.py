@@ -1,54 +1,345 @@
+import asyncio
+import json
+import logging
+import queue
+import secrets
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+from cache import LRUCache
 from config import Config
+from perf import instrument
 
+logger = logging.getLogger(__name__)
+
+DEACTIVATE_CHUNK = 500  # id в одном IN (...) при деактивации, ниже лимита параметров SQLite
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+)
+
+COUNTER_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_users_insert AFTER INSERT ON users
+    BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'users';
+        INSERT INTO daily_registrations (date, new_users)
+        VALUES (strftime('%Y-%m-%d', NEW.created_at), 1)
+        ON CONFLICT(date) DO UPDATE SET new_users = new_users + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_configs_insert AFTER INSERT ON configs
+    WHEN NEW.is_active = 1
+    BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'active_configs';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_configs_active AFTER UPDATE OF is_active ON configs
+    WHEN OLD.is_active != NEW.is_active
+    BEGIN
+        UPDATE counters
+        SET value = value + CASE WHEN NEW.is_active = 1 THEN 1 ELSE -1 END
+        WHERE name = 'active_configs';
+    END
+    """,
+)
+
+@instrument("db")
 class Database:
-    def __init__(self, db_path: str = "vpnbot.db"):
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row
-        self._init_db()
-
-    def _init_db(self) -> None:
-        with self.conn:
-            self.conn.executescript("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER UNIQUE,
-                    username TEXT,
-                    full_name TEXT,
-                    is_admin BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-                
-                CREATE TABLE IF NOT EXISTS configs (
-                    id TEXT PRIMARY KEY,
-                    user_id INTEGER,
-                    inbound_id INTEGER,
-                    email TEXT,
-                    uuid TEXT,
-                    port INTEGER,
-                    flow TEXT,
-                    data TEXT,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY(user_id) REFERENCES users(id)
-                );
-                
-                CREATE INDEX IF NOT EXISTS idx_user_id ON configs(user_id);
-                CREATE INDEX IF NOT EXISTS idx_config_active ON configs(is_active);
-            """)
-
-    def get_user(self, telegram_id: int) -> Optional[Dict]:
-        cursor = self.conn.execute(
-            "SELECT * FROM users WHERE telegram_id = ?", 
+    """Асинхронный доступ к SQLite.
+
+    Все записи выполняет один поток-писатель: накопившиеся в очереди операции
+    применяются в одной транзакции (групповой коммит, каждая в своём SAVEPOINT),
+    чтобы один fsync обслуживал сразу несколько обработчиков. Чтение идёт через
+    пул потоков со своими соединениями - в режиме WAL оно не ждёт записи.
+    """
+
+    def __init__(self, db_path: str = Config.DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._config_listeners: List[Callable[[int], None]] = []
+        # Кэш горячих чтений: строка пользователя и его активные конфиги
+        self.caches = {
+            "users": LRUCache(Config.DB_CACHE_SIZE),
+            "configs": LRUCache(Config.DB_CACHE_SIZE),
+        }
+        writer_conn = self._connect()
+        self._init_db(writer_conn)
+
+        self._write_queue: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._writer_loop, args=(writer_conn,), name="db-writer", daemon=True
+        )
+        self._writer.start()
+        self._readers = ThreadPoolExecutor(
+            max_workers=Config.DB_READ_POOL_SIZE, thread_name_prefix="db-reader"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _init_db(self, conn: sqlite3.Connection) -> None:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE,
+                username TEXT,
+                full_name TEXT,
+                is_admin BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+
+            CREATE TABLE IF NOT EXISTS configs (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER,
+                node TEXT NOT NULL DEFAULT 'main',
+                inbound_id INTEGER,
+                client_id TEXT,
+                email TEXT,
+                uuid TEXT,
+                port INTEGER,
+                flow TEXT,
+                data TEXT,
+                qr_file_id TEXT,
+                is_active BOOLEAN DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP,
+                expiry_notified BOOLEAN DEFAULT FALSE,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_config_active ON configs(is_active);
+            CREATE INDEX IF NOT EXISTS idx_configs_user_active ON configs(user_id, is_active);
+            DROP INDEX IF EXISTS idx_user_id;
+
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS daily_registrations (
+                date TEXT PRIMARY KEY,
+                new_users INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL,
+                admin_id INTEGER,
+                is_finished BOOLEAN DEFAULT FALSE,
+                last_user_id INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            );
+
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                chat_id INTEGER,
+                message_id INTEGER,
+                idempotency_key TEXT,
+                result TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+
+            CREATE TABLE IF NOT EXISTS traffic_snapshots (
+                email TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                up INTEGER NOT NULL,
+                down INTEGER NOT NULL,
+                PRIMARY KEY (email, bucket)
+            ) WITHOUT ROWID;
+
+            CREATE INDEX IF NOT EXISTS idx_traffic_bucket ON traffic_snapshots(bucket);
+        """)
+        self._ensure_columns(conn, "users", {"sub_token": "TEXT"})
+        added = self._ensure_columns(conn, "configs", {
+            "client_id": "TEXT",
+            "qr_file_id": "TEXT",
+            "node": "TEXT NOT NULL DEFAULT 'main'",
+            "expires_at": "TIMESTAMP",
+            "expiry_notified": "BOOLEAN DEFAULT FALSE"
+        })
+        if "expires_at" in added and Config.DEFAULT_EXPIRE_DAYS > 0:
+            # Конфиги, созданные до появления срока действия, отсчитываются от даты создания
+            conn.execute(
+                "UPDATE configs SET expires_at = datetime(created_at, ?) WHERE is_active = 1",
+                (f"+{Config.DEFAULT_EXPIRE_DAYS} days",)
+            )
+        self._ensure_columns(conn, "jobs", {"idempotency_key": "TEXT"})
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_configs_node_active ON configs(node, is_active)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_configs_expires ON configs(expires_at, id) WHERE is_active = 1")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_idempotency ON jobs(idempotency_key)")
+        # Ключ защищает только от повторов, пока задача выполняется: у завершённых он сбрасывается
+        conn.execute("UPDATE jobs SET idempotency_key = NULL WHERE status != 'pending' AND idempotency_key IS NOT NULL")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_sub_token ON users(sub_token)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username COLLATE NOCASE)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_configs_user_page ON configs(user_id, id) WHERE is_active = 1")
+        self._init_counters(conn)
+
+    def _init_counters(self, conn: sqlite3.Connection) -> None:
+        """Счётчики и дневная статистика, которые поддерживают триггеры.
+
+        При первом запуске на существующей БД они заполняются по текущим данным
+        в той же транзакции, в которой создаются триггеры.
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT COUNT(*) FROM counters").fetchone()[0] == 0:
+                conn.execute("INSERT INTO counters (name, value) SELECT 'users', COUNT(*) FROM users")
+                conn.execute(
+                    "INSERT INTO counters (name, value) SELECT 'active_configs', COUNT(*) FROM configs WHERE is_active = 1"
+                )
+                conn.execute("DELETE FROM daily_registrations")
+                conn.execute("""
+                    INSERT INTO daily_registrations (date, new_users)
+                    SELECT strftime('%Y-%m-%d', created_at), COUNT(*) FROM users GROUP BY 1
+                """)
+            for trigger in COUNTER_TRIGGERS:
+                conn.execute(trigger)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _ensure_columns(self, conn: sqlite3.Connection, table: str, columns: Dict[str, str]) -> List[str]:
+        """Добавление колонок, которых нет в БД, созданной старой версией бота"""
+        existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+        added = []
+        for name, definition in columns.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                added.append(name)
+        return added
+
+    def _reader_conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    async def _read(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполнение fn(conn) в пуле читателей"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, lambda: fn(self._reader_conn()))
+
+    async def _write(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполнение fn(conn) в потоке-писателе; результат доступен после COMMIT"""
+        future: Future = Future()
+        self._write_queue.put((fn, future))
+        return await asyncio.wrap_future(future)
+
+    async def _fetchone(self, sql: str, params: tuple = ()) -> Optional[sqlite3.Row]:
+        return await self._read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def _fetchall(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        return await self._read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def _execute(self, sql: str, params: tuple = ()) -> int:
+        return await self._write(lambda conn: conn.execute(sql, params).rowcount)
+
+    def _writer_loop(self, conn: sqlite3.Connection) -> None:
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + Config.DB_COMMIT_DELAY
+            while len(batch) < Config.DB_BATCH_SIZE:
+                try:
+                    timeout = deadline - time.monotonic()
+                    if timeout > 0:
+                        item = self._write_queue.get(timeout=timeout)
+                    else:
+                        item = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit_batch(conn, batch)
+            if stop:
+                break
+        conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list) -> None:
+        """Применение пачки операций в одной транзакции"""
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    result = fn(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    results.append((future, None, e))
+                else:
+                    results.append((future, result, None))
+                conn.execute("RELEASE op")
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Ошибка записи в БД: {str(e)}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(future, None, e) for _, future in batch]
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def close(self) -> None:
+        """Дожидается записи очереди и закрывает соединения"""
+        self._write_queue.put(None)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._writer.join)
+        self._readers.shutdown(wait=True)
+
+    async def get_user(self, telegram_id: int) -> Optional[Dict]:
+        cache = self.caches["users"]
+        found, user = cache.get(telegram_id)
+        if found:
+            return user
+        generation = cache.generation
+        user = await self._fetchone(
+            "SELECT * FROM users WHERE telegram_id = ?",
             (telegram_id,)
         )
-        return cursor.fetchone()
+        cache.put(telegram_id, user, generation)
+        return user
 
-    def add_user(self, user_data: Dict) -> None:
-        self.conn.execute(
-            "INSERT INTO users (telegram_id, username, full_name, is_admin) VALUES (?, ?, ?, ?)",
+    async def add_user(self, user_data: Dict) -> None:
+        await self._execute(
+            "INSERT OR IGNORE INTO users (telegram_id, username, full_name, is_admin) VALUES (?, ?, ?, ?)",
             (
                 user_data["id"],
                 user_data.get("username"),
@@ -56,54 +347,468 @@ class Database:
                 user_data["id"] in Config.ADMIN_IDS
             )
         )
-        self.conn.commit()
+        self.caches["users"].invalidate(user_data["id"])
+
+    async def _counter(self, name: str) -> int:
+        row = await self._fetchone("SELECT value FROM counters WHERE name = ?", (name,))
+        return row[0] if row else 0
+
+    async def count_users(self) -> int:
+        return await self._counter("users")
+
+    @staticmethod
+    def _keyset_page(conn: sqlite3.Connection, select: str, where: str, params: tuple, key: str,
+                     after: Any, before: Any, limit: int) -> Tuple[List[sqlite3.Row], bool, bool]:
+        """Страница по индексу key после after или до before: (строки, есть ли раньше, есть ли дальше).
+
+        Стоимость не зависит от номера страницы: курсор - значение ключа, а не OFFSET.
+        """
+        if before is not None:
+            rows = conn.execute(
+                f"{select} WHERE {where} AND {key} < ? ORDER BY {key} DESC LIMIT ?", params + (before, limit)
+            ).fetchall()[::-1]
+        elif after is not None:
+            rows = conn.execute(
+                f"{select} WHERE {where} AND {key} > ? ORDER BY {key} LIMIT ?", params + (after, limit)
+            ).fetchall()
+        else:
+            rows = conn.execute(f"{select} WHERE {where} ORDER BY {key} LIMIT ?", params + (limit,)).fetchall()
+        if not rows:
+            if after is not None or before is not None:
+                # Строки страницы успели удалить - показываем первую
+                return Database._keyset_page(conn, select, where, params, key, None, None, limit)
+            return [], False, False
+
+        def exists(op: str, value: Any) -> bool:
+            return conn.execute(f"{select} WHERE {where} AND {key} {op} ? LIMIT 1", params + (value,)).fetchone() is not None
+        return rows, exists("<", rows[0][key]), exists(">", rows[-1][key])
+
+    async def get_users_page(self, after: int = None, before: int = None,
+                             limit: int = Config.LIST_PAGE_SIZE) -> Tuple[List[Dict], bool, bool]:
+        """Страница пользователей по первичному ключу"""
+        return await self._read(lambda conn: self._keyset_page(
+            conn, "SELECT id, telegram_id, username, full_name FROM users", "1", (), "id", after, before, limit
+        ))
+
+    async def search_users(self, query: str, limit: int = Config.LIST_PAGE_SIZE) -> List[Dict]:
+        """Поиск по telegram_id или началу username (по индексам, без полного просмотра)"""
+        query = query.strip().lstrip("@")
+        if query.isdigit():
+            user = await self.get_user(int(query))
+            return [user] if user else []
+        if not query:
+            return []
+        return await self._fetchall(
+            "SELECT id, telegram_id, username, full_name FROM users "
+            "WHERE username >= ? COLLATE NOCASE AND username < ? COLLATE NOCASE "
+            "ORDER BY username COLLATE NOCASE LIMIT ?",
+            (query, query + "\uffff", limit)
+        )
+
+    async def get_user_ids_after(self, last_id: int, limit: int) -> List[Dict]:
+        """Порция пользователей после last_id (keyset по первичному ключу)"""
+        return await self._fetchall(
+            "SELECT id, telegram_id FROM users WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, limit)
+        )
 
-    def create_config(self, user_id: int, config_data: Dict) -> str:
-        config_id = f"cfg-{user_id}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        expires_at = (datetime.now() + timedelta(days=Config.DEFAULT_EXPIRE_DAYS)) if Config.DEFAULT_EXPIRE_DAYS > 0 else None
-        
-        self.conn.execute(
-            "INSERT INTO configs (id, user_id, inbound_id, email, uuid, port, flow, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    @staticmethod
+    def _insert_config(conn: sqlite3.Connection, user_id: int, config_data: Dict) -> str:
+        config_id = f"cfg-{user_id}-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid4().hex[:6]}"
+        lifetime = f"+{Config.DEFAULT_EXPIRE_DAYS} days" if Config.DEFAULT_EXPIRE_DAYS > 0 else None
+        conn.execute(
+            "INSERT INTO configs (id, user_id, node, inbound_id, client_id, email, uuid, port, flow, data, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now', ?))",
             (
-                config_id, user_id, config_data["inbound_id"],
+                config_id, user_id, config_data["node"], config_data["inbound_id"],
+                config_data.get("client_id"),
                 config_data["email"], config_data["uuid"],
                 config_data["port"], config_data["flow"],
-                config_data["data"]
+                config_data["data"], lifetime
             )
         )
-        self.conn.commit()
         return config_id
 
-    def get_user_configs(self, user_id: int) -> List[Dict]:
-        cursor = self.conn.execute(
-            "SELECT id, inbound_id, email, uuid, port, flow, data FROM configs WHERE user_id = ? AND is_active = 1",
-            (user_id,)
-        )
-        return cursor.fetchall()
+    @staticmethod
+    def _deactivate_configs(conn: sqlite3.Connection, config_ids: List[str]) -> List[int]:
+        """Мягкое удаление конфигов; возвращает их владельцев"""
+        owners = set()
+        # Пачками по DEACTIVATE_CHUNK id: по одному SELECT и UPDATE на пачку
+        for start in range(0, len(config_ids), DEACTIVATE_CHUNK):
+            chunk = config_ids[start:start + DEACTIVATE_CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+            owners.update(row[0] for row in conn.execute(
+                f"SELECT DISTINCT user_id FROM configs WHERE id IN ({placeholders}) AND is_active = 1", chunk
+            ))
+            conn.execute(f"UPDATE configs SET is_active = 0 WHERE id IN ({placeholders}) AND is_active = 1", chunk)
+        return list(owners)
+
+    def add_config_listener(self, callback: Callable[[int], None]) -> None:
+        """Подписка на изменение набора активных конфигов пользователя"""
+        self._config_listeners.append(callback)
+
+    def _configs_changed(self, user_ids: List[int]) -> None:
+        for user_id in user_ids:
+            self.caches["configs"].invalidate(user_id)
+            for callback in self._config_listeners:
+                try:
+                    callback(user_id)
+                except Exception as e:
+                    logger.error(f"Ошибка обработчика изменения конфигов: {str(e)}")
 
-    def delete_config(self, config_id: str) -> bool:
-        self.conn.execute(
-            "UPDATE configs SET is_active = 0 WHERE id = ?",
+    async def create_config(self, user_id: int, config_data: Dict) -> str:
+        config_id = await self._write(lambda conn: self._insert_config(conn, user_id, config_data))
+        self._configs_changed([user_id])
+        return config_id
+
+    async def get_config(self, config_id: str) -> Optional[Dict]:
+        return await self._fetchone(
+            "SELECT * FROM configs WHERE id = ? AND is_active = 1",
             (config_id,)
         )
-        self.conn.commit()
-        return True
 
-    def count_user_configs(self, user_id: int) -> int:
-        cursor = self.conn.execute(
-            "SELECT COUNT(*) FROM configs WHERE user_id = ? AND is_active = 1",
+    async def set_qr_file_id(self, config_id: str, file_id: str) -> None:
+        await self._execute(
+            "UPDATE configs SET qr_file_id = ? WHERE id = ?",
+            (file_id, config_id)
+        )
+
+    async def get_user_config(self, user_id: int, config_id: str) -> Optional[Dict]:
+        """Активный конфиг по id, только если он принадлежит пользователю"""
+        return await self._fetchone(
+            "SELECT * FROM configs WHERE id = ? AND user_id = ? AND is_active = 1",
+            (config_id, user_id)
+        )
+
+    async def get_user_configs_page(self, user_id: int, after: str = None, before: str = None,
+                                    limit: int = Config.LIST_PAGE_SIZE) -> Tuple[List[Dict], bool, bool]:
+        """Страница активных конфигов пользователя по id (id начинаются с даты создания)"""
+        return await self._read(lambda conn: self._keyset_page(
+            conn, "SELECT id, node, email, port, expires_at FROM configs", "user_id = ? AND is_active = 1",
+            (user_id,), "id", after, before, limit
+        ))
+
+    async def get_user_configs(self, user_id: int) -> List[Dict]:
+        cache = self.caches["configs"]
+        found, configs = cache.get(user_id)
+        if found:
+            return configs
+        generation = cache.generation
+        configs = await self._fetchall(
+            "SELECT id, node, inbound_id, client_id, email, uuid, port, flow, data FROM configs WHERE user_id = ? AND is_active = 1",
             (user_id,)
         )
-        return cursor.fetchone()[0]
-
-    def get_detailed_stats(self) -> List[Dict]:
-        cursor = self.conn.execute("""
-            SELECT 
-                strftime('%Y-%m-%d', created_at) as date,
-                COUNT(*) as new_users
-            FROM users
-            GROUP BY date
-            ORDER BY date DESC
-            LIMIT 30
-        """)
-        return cursor.fetchall()
+        cache.put(user_id, configs, generation)
+        return configs
+
+    async def delete_config(self, config_id: str) -> bool:
+        self._configs_changed(await self._write(lambda conn: self._deactivate_configs(conn, [config_id])))
+        return True
+
+    async def get_used_ports(self, node: str) -> List[int]:
+        rows = await self._fetchall(
+            "SELECT DISTINCT port FROM configs WHERE node = ? AND is_active = 1 AND port IS NOT NULL",
+            (node,)
+        )
+        return [row[0] for row in rows]
+
+    async def count_user_configs(self, user_id: int) -> int:
+        return len(await self.get_user_configs(user_id))
+
+    async def count_active_configs(self) -> int:
+        return await self._counter("active_configs")
+
+    async def rename_node(self, old: str, new: str) -> int:
+        """Перенос конфигов со старого имени ноды на новое; возвращает число записей"""
+        def rename(conn) -> Tuple[List[int], int]:
+            user_ids = [row[0] for row in conn.execute(
+                "SELECT DISTINCT user_id FROM configs WHERE node = ?", (old,)
+            )]
+            return user_ids, conn.execute("UPDATE configs SET node = ? WHERE node = ?", (new, old)).rowcount
+        user_ids, renamed = await self._write(rename)
+        self._configs_changed(user_ids)
+        return renamed
+
+    async def count_active_configs_by_node(self) -> Dict[str, int]:
+        rows = await self._fetchall(
+            "SELECT node, COUNT(*) FROM configs WHERE is_active = 1 GROUP BY node"
+        )
+        return {row[0]: row[1] for row in rows}
+
+    async def get_detailed_stats(self, days: int = 30) -> List[Dict]:
+        return await self._fetchall(
+            "SELECT date, new_users FROM daily_registrations ORDER BY date DESC LIMIT ?",
+            (days,)
+        )
+
+    async def create_broadcast(self, text: str, admin_id: int) -> int:
+        return await self._write(lambda conn: conn.execute(
+            "INSERT INTO broadcasts (text, admin_id) VALUES (?, ?)",
+            (text, admin_id)
+        ).lastrowid)
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict]:
+        return await self._fetchone("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+
+    async def get_unfinished_broadcasts(self) -> List[Dict]:
+        return await self._fetchall("SELECT * FROM broadcasts WHERE is_finished = 0 ORDER BY id")
+
+    async def update_broadcast_progress(self, broadcast_id: int, last_user_id: int, sent: int, failed: int) -> None:
+        await self._execute(
+            "UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ? WHERE id = ?",
+            (last_user_id, sent, failed, broadcast_id)
+        )
+
+    async def finish_broadcast(self, broadcast_id: int) -> None:
+        await self._execute(
+            "UPDATE broadcasts SET is_finished = 1, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (broadcast_id,)
+        )
+
+    async def get_sub_token(self, telegram_id: int) -> str:
+        """Токен подписки пользователя (создаётся при первом запросе)"""
+        def get(conn: sqlite3.Connection) -> str:
+            conn.execute(
+                "UPDATE users SET sub_token = ? WHERE telegram_id = ? AND sub_token IS NULL",
+                (secrets.token_urlsafe(18), telegram_id)
+            )
+            return conn.execute("SELECT sub_token FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()[0]
+        token = await self._write(get)
+        self.caches["users"].invalidate(telegram_id)
+        return token
+
+    async def get_subscription(self, sub_token: str) -> Optional[Tuple[int, List[str]]]:
+        """Владелец токена и ссылки его активных конфигов"""
+        def get(conn: sqlite3.Connection):
+            user = conn.execute("SELECT telegram_id FROM users WHERE sub_token = ?", (sub_token,)).fetchone()
+            if not user:
+                return None
+            rows = conn.execute(
+                "SELECT data FROM configs WHERE user_id = ? AND is_active = 1 ORDER BY created_at, id",
+                (user[0],)
+            ).fetchall()
+            return user[0], [row[0] for row in rows]
+        return await self._read(get)
+
+    async def get_all_subscriptions(self) -> Dict[str, Tuple[int, List[str]]]:
+        """Все подписки одним запросом {токен: (владелец, ссылки)} для прогрева кэша"""
+        rows = await self._fetchall(
+            "SELECT u.sub_token, u.telegram_id, c.data FROM users u "
+            "LEFT JOIN configs c ON c.user_id = u.telegram_id AND c.is_active = 1 "
+            "WHERE u.sub_token IS NOT NULL ORDER BY u.telegram_id, c.created_at, c.id"
+        )
+        subscriptions = {}
+        for token, user_id, data in rows:
+            _, links = subscriptions.setdefault(token, (user_id, []))
+            if data:
+                links.append(data)
+        return subscriptions
+
+    async def get_active_configs_by_node(self, node: str) -> List[Dict]:
+        return await self._fetchall(
+            "SELECT id, user_id, node, inbound_id, client_id, email, port FROM configs WHERE node = ? AND is_active = 1",
+            (node,)
+        )
+
+    async def get_pending_job_emails(self) -> List[str]:
+        """Email клиентов из ещё не выполненных задач создания"""
+        rows = await self._fetchall(
+            "SELECT json_extract(payload, '$.client.email') FROM jobs WHERE kind = 'create' AND status = 'pending'"
+        )
+        return [row[0] for row in rows]
+
+    async def get_expired_configs(self, after: Tuple[str, str], limit: int) -> List[Dict]:
+        """Порция истёкших активных конфигов после ключа (expires_at, id)"""
+        return await self._fetchall(
+            # Без ANALYZE планировщик выбирает idx_config_active и сортирует все активные конфиги
+            "SELECT id, user_id, node, inbound_id, client_id, email, port, expires_at "
+            "FROM configs INDEXED BY idx_configs_expires "
+            "WHERE is_active = 1 AND expires_at <= CURRENT_TIMESTAMP AND (expires_at, id) > (?, ?) "
+            "ORDER BY expires_at, id LIMIT ?",
+            (*after, limit)
+        )
+
+    async def deactivate_configs(self, config_ids: List[str]) -> None:
+        """Мягкое удаление пачки конфигов одной транзакцией"""
+        self._configs_changed(await self._write(lambda conn: self._deactivate_configs(conn, config_ids)))
+
+    async def get_expiring_configs(self, days: int, limit: int) -> List[Dict]:
+        """Активные конфиги, истекающие в ближайшие days дней, о которых ещё не предупреждали"""
+        return await self._fetchall(
+            "SELECT id, user_id, email, expires_at FROM configs INDEXED BY idx_configs_expires "
+            "WHERE is_active = 1 AND expires_at <= datetime('now', ?) AND expiry_notified = 0 "
+            "ORDER BY expires_at, id LIMIT ?",
+            (f"+{days} days", limit)
+        )
+
+    async def mark_expiry_notified(self, config_ids: List[str]) -> None:
+        await self._write(lambda conn: conn.executemany(
+            "UPDATE configs SET expiry_notified = 1 WHERE id = ?",
+            [(config_id,) for config_id in config_ids]
+        ))
+
+    async def save_traffic(self, bucket: int, traffic: Dict[str, Tuple[int, int]], keep_after: int) -> None:
+        """Снимок счётчиков трафика: одна строка на конфиг за интервал, старые удаляются"""
+        def save(conn: sqlite3.Connection) -> None:
+            conn.executemany(
+                "INSERT INTO traffic_snapshots (email, bucket, up, down) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(email, bucket) DO UPDATE SET up = excluded.up, down = excluded.down",
+                [(email, bucket, up, down) for email, (up, down) in traffic.items()]
+            )
+            conn.execute("DELETE FROM traffic_snapshots WHERE bucket < ?", (keep_after,))
+        await self._write(save)
+
+    async def get_latest_traffic(self) -> List[Dict]:
+        """Последний снимок трафика каждого конфига.
+
+        Один проход по первичному ключу: при единственном MAX() SQLite берёт
+        up и down из той же строки, где достигнут максимум bucket.
+        """
+        return await self._fetchall(
+            "SELECT email, MAX(bucket) AS bucket, up, down FROM traffic_snapshots GROUP BY email"
+        )
+
+    async def get_traffic_growth(self, since_bucket: int) -> Dict[str, int]:
+        """Прирост трафика каждого конфига с указанного интервала, байт"""
+        rows = await self._fetchall(
+            "SELECT email, MAX(up + down) - MIN(up + down) FROM traffic_snapshots "
+            "WHERE bucket >= ? GROUP BY email HAVING COUNT(*) > 1",
+            (since_bucket,)
+        )
+        return {row[0]: row[1] for row in rows}
+
+    async def get_traffic_samples(self, since_bucket: int,
+                                  build: Callable[[List[str], List[int], Iterable[Tuple[int, int]]], Any]) -> Any:
+        """Снимки трафика с bucket >= since_bucket в порядке (email, bucket).
+
+        build(emails, counts, rows) вызывается в потоке-читателе: emails и counts -
+        конфиги и число их снимков, rows - курсор по (bucket, up + down). Email
+        не повторяется в каждой строке, а строки не собираются в список, так что
+        build может заполнять массивы прямо из курсора. Оба запроса читают один
+        снимок БД, поэтому сумма counts равна числу строк.
+        """
+        def load(conn: sqlite3.Connection):
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            conn.execute("BEGIN")
+            try:
+                counts = cursor.execute(
+                    "SELECT email, COUNT(*) FROM traffic_snapshots WHERE bucket >= ? GROUP BY email ORDER BY email",
+                    (since_bucket,)
+                ).fetchall()
+                rows = conn.cursor()
+                rows.row_factory = None
+                rows.execute(
+                    "SELECT bucket, up + down FROM traffic_snapshots WHERE bucket >= ? ORDER BY email, bucket",
+                    (since_bucket,)
+                )
+                return build([row[0] for row in counts], [row[1] for row in counts], rows)
+            finally:
+                conn.execute("COMMIT")
+        return await self._read(load)
+
+    async def get_config_owners(self) -> Dict[str, int]:
+        """Владелец каждого конфига {email: telegram_id}, включая удалённые"""
+        rows = await self._fetchall("SELECT email, user_id FROM configs")
+        return {row[0]: row[1] for row in rows}
+
+    async def get_usernames(self, telegram_ids: List[int]) -> Dict[int, str]:
+        if not telegram_ids:
+            return {}
+        placeholders = ", ".join("?" * len(telegram_ids))
+        rows = await self._fetchall(
+            f"SELECT telegram_id, username FROM users WHERE telegram_id IN ({placeholders})",
+            tuple(telegram_ids)
+        )
+        return {row[0]: row[1] for row in rows}
+
+    async def create_job(self, kind: str, user_id: int, payload: Dict, chat_id: int = None,
+                         message_id: int = None, idempotency_key: str = None,
+                         max_configs: int = None) -> Tuple[Optional[int], bool]:
+        """Создание задачи; возвращает (id задачи, создана ли новая).
+
+        Пока задача с тем же idempotency_key не завершена, новая не создаётся -
+        возвращается существующая (у завершённых задач ключ сброшен, поэтому
+        повторное нажатие старой кнопки создаёт новую задачу). При max_configs лимит проверяется в той же транзакции,
+        что и вставка, с учётом ещё не выполненных задач создания; при
+        превышении возвращается (None, False).
+        """
+        def create(conn: sqlite3.Connection) -> Tuple[Optional[int], bool]:
+            if idempotency_key is not None:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE idempotency_key = ? AND status = 'pending'", (idempotency_key,)
+                ).fetchone()
+                if row:
+                    return row[0], False
+            if max_configs is not None:
+                used = conn.execute(
+                    "SELECT (SELECT COUNT(*) FROM configs WHERE user_id = ? AND is_active = 1)"
+                    " + (SELECT COUNT(*) FROM jobs WHERE user_id = ? AND kind = ? AND status = 'pending')",
+                    (user_id, user_id, kind)
+                ).fetchone()[0]
+                if used >= max_configs:
+                    return None, False
+            job_id = conn.execute(
+                "INSERT INTO jobs (kind, user_id, payload, chat_id, message_id, idempotency_key) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, user_id, json.dumps(payload), chat_id, message_id, idempotency_key)
+            ).lastrowid
+            return job_id, True
+        return await self._write(create)
+
+    async def set_job_message(self, job_id: int, chat_id: int, message_id: int) -> None:
+        await self._execute(
+            "UPDATE jobs SET chat_id = ?, message_id = ? WHERE id = ?",
+            (chat_id, message_id, job_id)
+        )
+
+    async def get_job(self, job_id: int) -> Optional[Dict]:
+        return await self._fetchone("SELECT * FROM jobs WHERE id = ?", (job_id,))
+
+    async def get_pending_jobs(self) -> List[Dict]:
+        return await self._fetchall("SELECT * FROM jobs WHERE status = 'pending' ORDER BY id")
+
+    async def start_job(self, job_id: int) -> int:
+        """Учёт попытки до обращения к панели; возвращает номер попытки"""
+        def start(conn: sqlite3.Connection) -> int:
+            conn.execute(
+                "UPDATE jobs SET attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (job_id,)
+            )
+            return conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        return await self._write(start)
+
+    async def retry_job(self, job_id: int, error: str) -> None:
+        await self._execute(
+            "UPDATE jobs SET last_error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (error, job_id)
+        )
+
+    async def fail_job(self, job_id: int, error: str) -> None:
+        await self._execute(
+            "UPDATE jobs SET status = 'failed', idempotency_key = NULL, last_error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (error, job_id)
+        )
+
+    async def complete_create_job(self, job_id: int, user_id: int, config_data: Dict) -> str:
+        """Запись конфига и завершение задачи в одной транзакции"""
+        def complete(conn: sqlite3.Connection) -> str:
+            config_id = self._insert_config(conn, user_id, config_data)
+            conn.execute(
+                "UPDATE jobs SET status = 'done', idempotency_key = NULL, result = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (config_id, job_id)
+            )
+            return config_id
+        config_id = await self._write(complete)
+        self._configs_changed([user_id])
+        return config_id
+
+    async def complete_delete_job(self, job_id: int, config_id: str) -> None:
+        """Деактивация конфига и завершение задачи в одной транзакции"""
+        def complete(conn: sqlite3.Connection) -> List[int]:
+            owners = self._deactivate_configs(conn, [config_id])
+            conn.execute(
+                "UPDATE jobs SET status = 'done', idempotency_key = NULL, result = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (config_id, job_id)
+            )
+            return owners
+        self._configs_changed(await self._write(complete))
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import List
+from telegram import Bot
+from telegram.error import TelegramError
+from config import Config
+from database import Database
+from nodes import NodePool
+from xui_client import XUIError
+
+logger = logging.getLogger(__name__)
+
+class ExpiryReaper:
+    """Удаление конфигов с истёкшим сроком действия (DEFAULT_EXPIRE_DAYS).
+
+    Раз в EXPIRY_CHECK_INTERVAL истёкшие конфиги выбираются порциями по
+    индексу expires_at, удаляются на панели не более чем EXPIRY_CONCURRENCY
+    запросами одновременно и деактивируются в БД одной транзакцией на порцию.
+    За EXPIRY_NOTIFY_DAYS до истечения пользователю приходит предупреждение.
+    """
+
+    def __init__(self, bot: Bot, db: Database, nodes: NodePool):
+        self.bot = bot
+        self.db = db
+        self.nodes = nodes
+        self._task = None
+
+    def start(self) -> None:
+        if Config.DEFAULT_EXPIRE_DAYS > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                removed = await self.reap()
+                if removed:
+                    logger.info(f"Expiry reaper removed {removed} configs")
+                await self.notify_expiring()
+            except Exception as e:
+                logger.error(f"Ошибка удаления истёкших конфигов: {str(e)}", exc_info=True)
+            await asyncio.sleep(Config.EXPIRY_CHECK_INTERVAL)
+
+    async def reap(self) -> int:
+        """Один проход по истёкшим конфигам; возвращает число удалённых"""
+        semaphore = asyncio.Semaphore(Config.EXPIRY_CONCURRENCY)
+        after = ("", "")
+        removed = 0
+
+        async def remove(config) -> bool:
+            async with semaphore:
+                try:
+                    return await self.nodes.remove_config(config)
+                except XUIError as e:
+                    logger.warning(f"Не удалось удалить истёкший конфиг {config['id']}: {str(e)}")
+                    return False
+
+        while True:
+            batch = await self.db.get_expired_configs(after, Config.EXPIRY_BATCH_SIZE)
+            if not batch:
+                break
+            results = await asyncio.gather(*(remove(config) for config in batch))
+            done = [config["id"] for config, ok in zip(batch, results) if ok]
+            if done:
+                await self.db.deactivate_configs(done)
+                removed += len(done)
+            # Неудачные остаются активными и будут повторены в следующий проход
+            after = (batch[-1]["expires_at"], batch[-1]["id"])
+        return removed
+
+    async def notify_expiring(self) -> None:
+        """Предупреждение владельцев конфигов, срок которых скоро истекает"""
+        while True:
+            configs = await self.db.get_expiring_configs(Config.EXPIRY_NOTIFY_DAYS, Config.EXPIRY_BATCH_SIZE)
+            if not configs:
+                return
+            by_user = defaultdict(list)
+            for config in configs:
+                by_user[config["user_id"]].append(config)
+            for user_id, user_configs in by_user.items():
+                await self._notify(user_id, user_configs)
+                await asyncio.sleep(1 / Config.BROADCAST_RATE)
+            await self.db.mark_expiry_notified([config["id"] for config in configs])
+
+    async def _notify(self, user_id: int, configs: List) -> None:
+        lines = ["⏳ Скоро истекает срок действия конфигов:"]
+        lines.extend(f"🔹 {config['email']} - до {config['expires_at']} UTC" for config in configs)
+        lines.append("\nПосле этого они будут удалены. Новый конфиг можно создать в меню бота.")
+        try:
+            await self.bot.send_message(chat_id=user_id, text="\n".join(lines))
+        except TelegramError as e:
+            logger.warning(f"Не удалось предупредить {user_id} об истечении конфигов: {str(e)}")
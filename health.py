@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def _measure_speed() -> dict:
+    """Замер скорости загрузки (блокирующий, выполняется в пуле потоков)"""
+    import speedtest
+    st = speedtest.Speedtest()
+    st.get_best_server()
+    speed = st.download() / 1_000_000  # Мбит/с
+    return {
+        "speed": speed,
+        "server": st.results.server["name"],
+        "measured_at": datetime.now()
+    }
+
+class SpeedTest:
+    """Фоновый speedtest с кэшем последнего результата"""
+
+    def __init__(self):
+        self.last_result: Optional[dict] = None
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, on_done=None) -> bool:
+        """Запуск замера в фоне; False, если замер уже идёт"""
+        if self.running:
+            return False
+        self._task = asyncio.create_task(self._run(on_done))
+        return True
+
+    async def _run(self, on_done) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            self.last_result = await loop.run_in_executor(None, _measure_speed)
+            self.last_error = None
+        except ImportError:
+            self.last_error = "Модуль speedtest-cli не установлен"
+        except Exception as e:
+            logger.error(f"Ошибка speedtest: {str(e)}")
+            self.last_error = str(e)
+        if on_done:
+            try:
+                await on_done()
+            except Exception as e:
+                logger.error(f"Не удалось отправить результат speedtest: {str(e)}")
+
+async def _probe_port(host: str, port: int, timeout: float) -> Optional[float]:
+    """Время TCP-подключения в мс или None, если порт не отвечает"""
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    latency = (time.perf_counter() - started) * 1000
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return latency
+
+async def probe_ports(host: str, ports: Iterable[int],
+                      concurrency: int = Config.PROBE_CONCURRENCY,
+                      timeout: float = Config.PROBE_TIMEOUT) -> Dict[int, Optional[float]]:
+    """Параллельная проверка портов inbound с ограничением числа соединений"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(port: int) -> Optional[float]:
+        async with semaphore:
+            return await _probe_port(host, port, timeout)
+
+    ports = list(ports)
+    latencies = await asyncio.gather(*(probe(port) for port in ports))
+    return dict(zip(ports, latencies))
+
+def format_probe_report(host: str, results: Dict[int, Optional[float]], limit: int = 20) -> str:
+    """Текст отчёта о проверке для админа"""
+    alive = {port: ms for port, ms in results.items() if ms is not None}
+    dead = sorted(port for port, ms in results.items() if ms is None)
+
+    lines = [
+        f"🩺 Проверка {host}\n",
+        f"✅ Отвечают: {len(alive)}",
+        f"❌ Не отвечают: {len(dead)}"
+    ]
+    if alive:
+        values = sorted(alive.values())
+        lines.append(f"⏱ Задержка: медиана {values[len(values) // 2]:.0f} мс, макс {values[-1]:.0f} мс")
+        slowest = sorted(alive.items(), key=lambda item: item[1], reverse=True)[:limit]
+        lines.append("\nСамые медленные порты:")
+        lines.extend(f"{port}: {ms:.0f} мс" for port, ms in slowest)
+    if dead:
+        lines.append("\nНедоступные порты:")
+        lines.append(", ".join(str(port) for port in dead[:limit * 5]))
+        if len(dead) > limit * 5:
+            lines.append(f"... и ещё {len(dead) - limit * 5}")
+    return "\n".join(lines)
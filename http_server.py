@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_SIZE = 8 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+KEEPALIVE_TIMEOUT = 15.0
+
+REASONS = {
+    200: "OK", 304: "Not Modified", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+class Request:
+    def __init__(self, method: str, path: str, headers: Dict[str, str], query: str = ""):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.query = query
+        self.body = b""
+
+class Response:
+    def __init__(self, status: int = 200, body: bytes = b"", headers: Dict[str, str] = None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+class HTTPServer:
+    """Минимальный HTTP/1.1 сервер на asyncio.
+
+    Нужен для лёгких эндпоинтов (подписки), которым не нужен полноценный
+    веб-фреймворк: разбираются строка запроса, заголовки и тело с
+    Content-Length, соединения keep-alive переиспользуются. Обработчики
+    выбираются по префиксу пути, по умолчанию принимают только GET и HEAD.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._routes: List[Tuple[str, Handler, Tuple[str, ...]]] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, prefix: str, handler: Handler, methods: Tuple[str, ...] = ("GET", "HEAD")) -> None:
+        self._routes.append((prefix, handler, methods))
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._serve, self.host, self.port, limit=MAX_HEADER_SIZE
+        )
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._write(writer, Response(400), keep_alive=False)
+                    break
+
+                request = self._parse(head)
+                if request is None:
+                    await self._write(writer, Response(400), keep_alive=False)
+                    break
+
+                try:
+                    length = int(request.headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_BODY_SIZE or "chunked" in request.headers.get("transfer-encoding", ""):
+                    await self._write(writer, Response(413 if length > MAX_BODY_SIZE else 400), keep_alive=False)
+                    break
+                if length:
+                    try:
+                        request.body = await asyncio.wait_for(reader.readexactly(length), KEEPALIVE_TIMEOUT)
+                    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                        break
+
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                response = await self._dispatch(request)
+                if request.method == "HEAD":
+                    response.headers["Content-Length"] = str(len(response.body))
+                    response.body = b""
+                await self._write(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse(head: bytes) -> Optional[Request]:
+        try:
+            lines = head.decode("latin-1").split("\r\n")
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        path, _, query = target.partition("?")
+        return Request(method, path, headers, query)
+
+    async def _dispatch(self, request: Request) -> Response:
+        for prefix, handler, methods in self._routes:
+            if request.path.startswith(prefix):
+                if request.method not in methods:
+                    return Response(405, headers={"Allow": ", ".join(methods)})
+                try:
+                    return await handler(request)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки {request.path}: {str(e)}", exc_info=True)
+                    return Response(500)
+        return Response(404)
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+        headers = {"Content-Length": str(len(response.body))}
+        headers.update(response.headers)
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        head = f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + response.body)
+        await writer.drain()
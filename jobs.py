@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Optional, Tuple
+from config import Config
+from database import Database
+from nodes import NodePool
+from ports import NoFreePortsError
+from xui_client import XUIClient, XUIError, XUIUnavailable
+
+logger = logging.getLogger(__name__)
+
+JOB_CREATE = "create"
+JOB_DELETE = "delete"
+
+# on_finished(job, result, error): result - id конфига, error - текст ошибки для пользователя
+JobCallback = Callable[[dict, Optional[str], Optional[str]], Awaitable[None]]
+
+class PanelJobQueue:
+    """Очередь операций с панелью (создание и удаление конфигов).
+
+    Задача сначала записывается в таблицу jobs, и только потом выполняется
+    воркером, поэтому обработчик отвечает пользователю сразу, а незавершённые
+    задачи продолжаются после перезапуска. Клиент с email создаётся заранее и
+    хранится в задаче: при повторной попытке бот сперва ищет его на панели,
+    так что сбой между вызовом панели и записью в БД не оставляет лишних inbound.
+    """
+
+    def __init__(self, db: Database, nodes: NodePool, on_finished: JobCallback):
+        self.db = db
+        self.nodes = nodes
+        self.on_finished = on_finished
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._workers = []
+        self._timers = set()
+
+    async def start(self) -> None:
+        """Запуск воркеров и возобновление незавершённых задач"""
+        pending = await self.db.get_pending_jobs()
+        for job in pending:
+            self._queue.put_nowait(job["id"])
+        if pending:
+            logger.info(f"Resuming {len(pending)} pending panel jobs")
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(Config.JOB_WORKERS)]
+
+    async def stop(self) -> None:
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def enqueue_create(self, user_id: int, chat_id: int,
+                             idempotency_key: str = None) -> Tuple[Optional[int], bool]:
+        """Запись задачи создания с атомарной проверкой лимита конфигов"""
+        payload = {"client": XUIClient.new_client()}
+        return await self.db.create_job(
+            JOB_CREATE, user_id, payload, chat_id=chat_id,
+            idempotency_key=idempotency_key, max_configs=Config.MAX_CONFIGS_PER_USER
+        )
+
+    async def enqueue_delete(self, user_id: int, config_id: str, chat_id: int,
+                             idempotency_key: str = None) -> Tuple[Optional[int], bool]:
+        return await self.db.create_job(
+            JOB_DELETE, user_id, {"config_id": config_id}, chat_id=chat_id,
+            idempotency_key=idempotency_key
+        )
+
+    async def submit(self, job_id: int, chat_id: int, message_id: int) -> None:
+        """Привязка сообщения-заглушки и передача задачи воркерам"""
+        await self.db.set_job_message(job_id, chat_id, message_id)
+        self._queue.put_nowait(job_id)
+
+    def _schedule(self, job_id: int, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+
+        def requeue():
+            self._timers.discard(timer)
+            self._queue.put_nowait(job_id)
+
+        timer = loop.call_later(delay, requeue)
+        self._timers.add(timer)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка обработки задачи #{job_id}: {str(e)}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job_id: int) -> None:
+        job = await self.db.get_job(job_id)
+        if not job or job["status"] != "pending":
+            return
+
+        attempt = await self.db.start_job(job_id)
+        payload = json.loads(job["payload"])
+        try:
+            if job["kind"] == JOB_CREATE:
+                result = await self._create(job, payload, attempt)
+            else:
+                result = await self._delete(job, payload)
+        except NoFreePortsError as e:
+            await self._fail(job, str(e), "❌ Нет свободных портов. Обратитесь к администратору.")
+            return
+        except Exception as e:
+            if attempt >= Config.JOB_MAX_ATTEMPTS:
+                message = str(e) if isinstance(e, XUIError) else "Внутренняя ошибка"
+                await self._fail(job, str(e), f"❌ {message}")
+                return
+            delay = Config.JOB_RETRY_BASE_DELAY * 2 ** (attempt - 1)
+            if not isinstance(e, XUIUnavailable):
+                logger.warning(f"Job #{job_id} attempt {attempt} failed, retry in {delay:.0f} s: {str(e)}")
+            await self.db.retry_job(job_id, str(e))
+            self._schedule(job_id, delay)
+            return
+
+        await self._notify(job, result, None)
+
+    async def _create(self, job, payload: dict, attempt: int) -> str:
+        client = payload["client"]
+        config = None
+        if attempt > 1:
+            # Предыдущая попытка могла создать конфиг на панели до сбоя
+            config = await self.nodes.find_config(client["email"])
+            if config:
+                logger.info(f"Job #{job['id']}: found config {client['email']} on node {config['node']}")
+        if config is None:
+            config = await self.nodes.create_config(client)
+        return await self.db.complete_create_job(job["id"], job["user_id"], config)
+
+    async def _delete(self, job, payload: dict) -> str:
+        config_id = payload["config_id"]
+        config = await self.db.get_config(config_id)
+        if config:
+            if not await self.nodes.remove_config(config):
+                raise XUIError("Панель не подтвердила удаление")
+        await self.db.complete_delete_job(job["id"], config_id)
+        return config_id
+
+    async def _fail(self, job, error: str, message: str) -> None:
+        logger.error(f"Job #{job['id']} ({job['kind']}) failed: {error}")
+        await self.db.fail_job(job["id"], error)
+        await self._notify(job, None, message)
+
+    async def _notify(self, job, result: Optional[str], error: Optional[str]) -> None:
+        try:
+            await self.on_finished(job, result, error)
+        except Exception as e:
+            logger.error(f"Не удалось сообщить о задаче #{job['id']}: {str(e)}")
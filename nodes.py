@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+from config import Config
+from database import Database
+from ports import NoFreePortsError, PortAllocator
+from xui_client import DEFAULT_NODE, CircuitBreaker, XUIClient, XUIError, XUIUnavailable, node_settings
+
+logger = logging.getLogger(__name__)
+
+class NodePool:
+    """Пул панелей 3X-UI (по одной на сервер).
+
+    Новый конфиг создаётся на наименее загруженной доступной ноде: нагрузка -
+    смесь долей ноды в активных конфигах и в трафике за сутки (его передаёт
+    TrafficMonitor после синхронизации) с учётом веса ноды. Ноды с разомкнутым circuit
+    breaker в выбор не попадают, а при ошибке создание конфига переходит на
+    следующую по нагрузке ноду.
+    """
+
+    def __init__(self):
+        self.settings = {node["name"]: node for node in node_settings()}
+        self.clients: Dict[str, XUIClient] = {
+            name: XUIClient(node) for name, node in self.settings.items()
+        }
+        self.ports: Dict[str, PortAllocator] = {}
+        for name in self.clients:
+            self.ports[name] = PortAllocator(Config.PORT_RANGE)
+            for port in Config.SHARED_INBOUND_PORTS:
+                self.ports[name].mark_used(port)
+        self.active_configs = {name: 0 for name in self.clients}
+        self.recent_traffic = {name: 0 for name in self.clients}
+
+    def get(self, name: str) -> XUIClient:
+        """Клиент панели по имени ноды.
+
+        Неизвестная нода - ошибка: подставить другую панель нельзя, там тот же
+        inbound_id принадлежит чужому конфигу. Старые записи переносятся явно
+        через Config.LEGACY_NODE.
+        """
+        client = self.clients.get(name)
+        if client is None:
+            raise XUIError(f"Нода {name} отсутствует в настройках")
+        return client
+
+    async def load(self, db: Database) -> None:
+        """Загрузка занятых портов и нагрузки нод при старте"""
+        if Config.LEGACY_NODE and Config.LEGACY_NODE != DEFAULT_NODE:
+            if Config.LEGACY_NODE not in self.clients:
+                raise ValueError(f"LEGACY_NODE {Config.LEGACY_NODE} отсутствует в NODES")
+            renamed = await db.rename_node(DEFAULT_NODE, Config.LEGACY_NODE)
+            if renamed:
+                logger.info(f"Moved {renamed} configs from node {DEFAULT_NODE} to {Config.LEGACY_NODE}")
+        counts = await db.count_active_configs_by_node()
+        for name in counts.keys() - self.clients.keys():
+            logger.error(
+                f"{counts[name]} active configs on node {name}, which is not configured: "
+                f"they will not be deleted or reconciled until the node is added back or moved with LEGACY_NODE"
+            )
+        for name in self.clients:
+            self.active_configs[name] = counts.get(name, 0)
+            self.ports[name].load(await db.get_used_ports(name))
+
+            if Config.PORT_SYNC_WITH_PANEL:
+                try:
+                    for inbound in await self.clients[name].list_inbounds():
+                        self.ports[name].mark_used(inbound["port"])
+                except XUIError as e:
+                    logger.warning(f"Не удалось загрузить порты из панели {name}: {str(e)}")
+            logger.info(f"Node {name}: {self.active_configs[name]} active configs, {self.ports[name].free_count} free ports")
+
+    def is_healthy(self, name: str) -> bool:
+        return self.clients[name].breaker.state != CircuitBreaker.OPEN
+
+    def set_recent_traffic(self, traffic: Dict[str, int]) -> None:
+        """Трафик нод за последние сутки, байт"""
+        self.recent_traffic.update((name, traffic.get(name, 0)) for name in self.clients)
+
+    def load_score(self, name: str) -> float:
+        total_configs = sum(self.active_configs.values())
+        total_traffic = sum(self.recent_traffic.values())
+        config_share = self.active_configs[name] / total_configs if total_configs else 0.0
+        traffic_share = self.recent_traffic[name] / total_traffic if total_traffic else 0.0
+        factor = Config.NODE_TRAFFIC_FACTOR
+        load = (1 - factor) * config_share + factor * traffic_share
+        return load / max(self.settings[name].get("weight", 1.0), 0.01)
+
+    def ranked(self) -> List[str]:
+        """Ноды в порядке выбора: доступные по возрастанию нагрузки, затем недоступные"""
+        return sorted(self.clients, key=lambda name: (not self.is_healthy(name), self.load_score(name)))
+
+    async def _provision(self, name: str, client: dict = None) -> dict:
+        xui = self.clients[name]
+        if Config.PROVISIONING_MODE == "shared":
+            return await xui.add_client(client)
+
+        port = self.ports[name].reserve()
+        try:
+            return await xui.create_inbound(port, client)
+        except XUIError:
+            self.ports[name].release(port)
+            raise
+
+    async def create_config(self, client: dict = None) -> dict:
+        """Создание конфига на лучшей ноде с переходом на следующую при ошибке"""
+        errors = []
+        for name in self.ranked():
+            try:
+                config = await self._provision(name, client)
+            except (NoFreePortsError, XUIError) as e:
+                if not isinstance(e, XUIUnavailable):
+                    logger.error(f"Node {name} failed to create config: {str(e)}")
+                errors.append(e)
+                continue
+            self.active_configs[name] += 1
+            return config
+
+        if all(isinstance(e, NoFreePortsError) for e in errors):
+            raise errors[-1]
+        if all(isinstance(e, (XUIUnavailable, NoFreePortsError)) for e in errors):
+            raise XUIUnavailable("Все серверы временно недоступны, попробуйте через минуту")
+        raise XUIError(f"Не удалось создать конфиг: {str(errors[-1])}")
+
+    async def find_config(self, email: str) -> Optional[dict]:
+        """Поиск уже созданного конфига по email на всех нодах"""
+        for name, xui in self.clients.items():
+            config = await xui.find_config(email)
+            if config:
+                if not config["client_id"]:
+                    self.ports[name].mark_used(config["port"])
+                self.active_configs[name] += 1
+                return config
+        return None
+
+    async def remove_config(self, config) -> bool:
+        """Удаление конфига на его ноде"""
+        success = await self.get(config["node"]).remove_config(config)
+        if success:
+            self.config_removed(config)
+        return success
+
+    def config_removed(self, config) -> None:
+        """Учёт удалённого конфига: нагрузка ноды и освобождение порта"""
+        name = self.get(config["node"]).name
+        self.active_configs[name] = max(self.active_configs[name] - 1, 0)
+        if not config["client_id"]:
+            self.ports[name].release(config["port"])
+
+    def status_lines(self) -> List[str]:
+        """Состояние нод и их circuit breaker для админ-панели"""
+        lines = []
+        for name, client in self.clients.items():
+            breaker = client.breaker
+            state = breaker.state
+            if state == CircuitBreaker.OPEN:
+                status = f"⛔ недоступна, проба через {breaker.retry_in:.0f} с"
+            elif state == CircuitBreaker.HALF_OPEN:
+                status = "🟡 проверка"
+            else:
+                status = f"✅ ошибок подряд: {breaker.failures}"
+            lines.append(f"{name}: {self.active_configs[name]} конфигов, {status}")
+        return lines
+
+    async def warm_up(self) -> None:
+        """Фоновый вход во все панели после старта"""
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(client.warm_up() for client in self.clients.values()), return_exceptions=True
+        )
+        for name, result in zip(self.clients, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Не удалось подготовить сессию панели {name}: {str(result)}")
+        logger.info(f"3X-UI warm-up done in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    async def close(self) -> None:
+        for client in self.clients.values():
+            await client.close()
@@ -0,0 +1,155 @@
+import functools
+import inspect
+import logging
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы, с: от 0.5 мс до 30 с с шагом ~x2
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами (память не растёт)"""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """Оценка перцентиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+class PerfRegistry:
+    """Гистограммы длительностей по именам операций"""
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self.started = time.time()
+
+    def record(self, name: str, seconds: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+        if seconds >= Config.PERF_SLOW_THRESHOLD:
+            logger.warning(f"Slow call {name}: {seconds * 1000:.0f} ms")
+
+    @contextmanager
+    def timer(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def reset(self) -> None:
+        self.histograms.clear()
+        self.started = time.time()
+
+    def report(self, limit: int = 25) -> str:
+        """Таблица для /perf: операции по суммарному времени"""
+        if not self.histograms:
+            return "Замеров пока нет"
+        rows = sorted(self.histograms.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+        lines = [f"⏱ Замеры за {(time.time() - self.started) / 60:.0f} мин (мс: p50 / p95 / p99 / max)"]
+        for name, h in rows:
+            lines.append(
+                f"{name}: {h.count} шт, "
+                f"{h.percentile(0.5) * 1000:.1f} / {h.percentile(0.95) * 1000:.1f} / "
+                f"{h.percentile(0.99) * 1000:.1f} / {h.max * 1000:.1f}"
+            )
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        """Экспорт в текстовом формате Prometheus"""
+        metric = "vpnbot_call_duration_seconds"
+        lines = [f"# HELP {metric} Duration of bot operations", f"# TYPE {metric} histogram"]
+        for name, h in sorted(self.histograms.items()):
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(BUCKETS, h.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{op="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{op="{label}",le="+Inf"}} {h.count}')
+            lines.append(f'{metric}_sum{{op="{label}"}} {h.total}')
+            lines.append(f'{metric}_count{{op="{label}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+metrics = PerfRegistry()
+
+class StartupTimer:
+    """Длительность этапов запуска для лога"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def summary(self) -> str:
+        total = time.perf_counter() - self.started
+        return ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.phases) + \
+            f"; total {total * 1000:.0f} ms"
+
+def timed(name: str):
+    """Декоратор замера корутины"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                metrics.record(name, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+def instrument(prefix: str):
+    """Декоратор класса: замер всех публичных корутин как prefix.имя_метода"""
+    def decorate(cls):
+        for name, fn in list(vars(cls).items()):
+            if not name.startswith("_") and inspect.iscoroutinefunction(fn):
+                setattr(cls, name, timed(f"{prefix}.{name}")(fn))
+        return cls
+    return decorate
+
+_ID_SEGMENT = re.compile(r"/(\d+|[0-9a-f]{8}-[0-9a-f-]{27,})(?=/|$)")
+
+def path_name(path: str) -> str:
+    """Путь без идентификаторов, чтобы число гистограмм было ограничено"""
+    return _ID_SEGMENT.sub("/:id", path)
@@ -0,0 +1,94 @@
+import random
+import threading
+from typing import Iterable, Tuple
+
+
+class NoFreePortsError(Exception):
+    """В диапазоне не осталось свободных портов"""
+    pass
+
+
+class PortAllocator:
+    """Выдача портов из диапазона без коллизий.
+
+    Занятость хранится в битовой карте (1 бит на порт), свободные порты -
+    в перемешанном списке. Записи списка, занятые через mark_used, не
+    удаляются сразу, а пропускаются при выдаче, поэтому reserve и release
+    работают за амортизированное O(1).
+    """
+
+    def __init__(self, port_range: Tuple[int, int]):
+        self.first, self.last = port_range
+        self._size = self.last - self.first + 1
+        self._bitmap = bytearray((self._size + 7) // 8)
+        self._free = []
+        self._used_count = 0
+        self._lock = threading.Lock()
+        self._rebuild_free_list()
+
+    def _contains(self, port: int) -> bool:
+        return self.first <= port <= self.last
+
+    def _is_used(self, offset: int) -> bool:
+        return bool(self._bitmap[offset >> 3] & (1 << (offset & 7)))
+
+    def _set_used(self, offset: int, used: bool) -> None:
+        if used:
+            self._bitmap[offset >> 3] |= 1 << (offset & 7)
+        else:
+            self._bitmap[offset >> 3] &= ~(1 << (offset & 7))
+
+    def _rebuild_free_list(self) -> None:
+        self._free = [offset for offset in range(self._size) if not self._is_used(offset)]
+        random.shuffle(self._free)
+
+    def load(self, ports: Iterable[int]) -> None:
+        """Пометка уже занятых портов при старте"""
+        with self._lock:
+            for port in ports:
+                if port is None or not self._contains(port):
+                    continue
+                offset = port - self.first
+                if not self._is_used(offset):
+                    self._set_used(offset, True)
+                    self._used_count += 1
+            self._rebuild_free_list()
+
+    def mark_used(self, port: int) -> None:
+        """Пометка порта, занятого в обход аллокатора"""
+        if not self._contains(port):
+            return
+        with self._lock:
+            offset = port - self.first
+            if not self._is_used(offset):
+                self._set_used(offset, True)
+                self._used_count += 1
+
+    def reserve(self) -> int:
+        """Резервирование случайного свободного порта"""
+        with self._lock:
+            while self._free:
+                offset = self._free.pop()
+                if not self._is_used(offset):
+                    self._set_used(offset, True)
+                    self._used_count += 1
+                    return self.first + offset
+            raise NoFreePortsError(f"Нет свободных портов в диапазоне {self.first}-{self.last}")
+
+    def release(self, port: int) -> None:
+        """Возврат порта в пул свободных"""
+        if port is None or not self._contains(port):
+            return
+        with self._lock:
+            offset = port - self.first
+            if self._is_used(offset):
+                self._set_used(offset, False)
+                self._used_count -= 1
+                # Ставим порт на случайное место, чтобы он не выдавался сразу повторно
+                self._free.append(offset)
+                i = random.randrange(len(self._free))
+                self._free[i], self._free[-1] = self._free[-1], self._free[i]
+
+    @property
+    def free_count(self) -> int:
+        return self._size - self._used_count
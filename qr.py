@@ -0,0 +1,59 @@
+import asyncio
+import io
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from config import Config
+from perf import timed
+
+logger = logging.getLogger(__name__)
+
+class QRError(Exception):
+    """Ошибки генерации QR-кода"""
+    pass
+
+def render_png(config_text: str) -> bytes:
+    """Генерация PNG с QR-кодом (блокирующая, выполняется в пуле)"""
+    # qrcode и PIL импортируются при первом QR, а не при старте бота
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(config_text)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    byte_io = io.BytesIO()
+    img.save(byte_io, 'PNG')
+    return byte_io.getvalue()
+
+def generate_qr(config_text: str) -> io.BytesIO:
+    """Синхронная генерация QR-кода из конфига"""
+    try:
+        return io.BytesIO(render_png(config_text))
+    except Exception as e:
+        raise QRError(f"Ошибка генерации QR: {str(e)}")
+
+class QRRenderer:
+    """Генерация QR-кодов в ограниченном пуле потоков или процессов,
+    чтобы кодирование PNG не блокировало event loop"""
+
+    def __init__(self, workers: int = Config.QR_WORKERS, use_processes: bool = Config.QR_USE_PROCESSES):
+        executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._executor: Executor = executor_cls(max_workers=workers)
+
+    @timed("qr.render")
+    async def render(self, config_text: str) -> io.BytesIO:
+        loop = asyncio.get_running_loop()
+        try:
+            png = await loop.run_in_executor(self._executor, render_png, config_text)
+        except Exception as e:
+            logger.error(f"Ошибка генерации QR-кода: {str(e)}")
+            raise QRError(f"Ошибка генерации QR-кода: {str(e)}")
+        return io.BytesIO(png)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from typing import List, Optional
+from config import Config
+from database import Database
+from nodes import NodePool
+from xui_client import XUIError, XUIUnavailable
+
+logger = logging.getLogger(__name__)
+
+REPORT_LIMIT = 10  # Сколько email показывать в отчёте для каждой категории
+
+class NodeDiff:
+    """Расхождения одной ноды: сироты на панели и призраки в БД"""
+
+    def __init__(self, node: str, db_count: int = 0, panel_count: int = 0,
+                 orphans: List[dict] = None, ghosts: List[dict] = None, error: str = None):
+        self.node = node
+        self.db_count = db_count
+        self.panel_count = panel_count
+        self.orphans = orphans or []
+        self.ghosts = ghosts or []
+        self.error = error
+        self.fixed_orphans = 0
+        self.fixed_ghosts = 0
+
+    @property
+    def clean(self) -> bool:
+        return not (self.orphans or self.ghosts or self.error)
+
+class Reconciler:
+    """Сверка активных конфигов в БД с панелями.
+
+    Для каждой ноды одним запросом берётся список inbound, конфиги бота с
+    обеих сторон индексируются по email и сравниваются разностью множеств.
+    Сироты - конфиги на панели без записи в БД (например, после сбоя до
+    записи), призраки - активные записи, которых на панели больше нет.
+    Клиенты ещё не выполненных задач создания сиротами не считаются.
+    """
+
+    def __init__(self, db: Database, nodes: NodePool):
+        self.db = db
+        self.nodes = nodes
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if Config.RECONCILE_INTERVAL > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(Config.RECONCILE_INTERVAL)
+            try:
+                for diff in await self.run(fix=Config.RECONCILE_AUTO_FIX):
+                    if not diff.clean:
+                        logger.warning(
+                            f"Reconcile {diff.node}: {len(diff.orphans)} orphans, {len(diff.ghosts)} ghosts"
+                            + (f", error: {diff.error}" if diff.error else "")
+                        )
+            except Exception as e:
+                logger.error(f"Ошибка сверки с панелью: {str(e)}", exc_info=True)
+
+    async def run(self, fix: bool = False) -> List[NodeDiff]:
+        """Сверка всех нод; при fix сироты удаляются с панели, призраки деактивируются"""
+        async with self._lock:
+            return [await self._reconcile_node(name, fix) for name in self.nodes.clients]
+
+    async def _reconcile_node(self, name: str, fix: bool) -> NodeDiff:
+        # Призраки считаются по БД, прочитанной до панели: запись, удалённая
+        # после чтения, ещё видна на панели и призраком не станет
+        db_configs = {row["email"]: row for row in await self.db.get_active_configs_by_node(name)}
+        try:
+            panel = await self.nodes.clients[name].list_configs()
+        except XUIError as e:
+            return NodeDiff(name, error=str(e))
+
+        # Сироты - по задачам и БД, прочитанным после панели: задача создания
+        # записана до запроса к панели, а её завершение пишет конфиг в той же
+        # транзакции, поэтому клиент, видимый на панели, найдётся в одном из
+        # двух чтений (задачи читаются первыми)
+        pending = set(await self.db.get_pending_job_emails())
+        known = {row["email"] for row in await self.db.get_active_configs_by_node(name)}
+        orphan_emails = panel.keys() - db_configs.keys() - known - pending
+        ghost_emails = db_configs.keys() - panel.keys()
+        diff = NodeDiff(
+            name, len(db_configs), len(panel),
+            orphans=[panel[email] for email in sorted(orphan_emails)],
+            ghosts=[db_configs[email] for email in sorted(ghost_emails)]
+        )
+        if fix:
+            await self._fix(diff)
+        return diff
+
+    async def _fix(self, diff: NodeDiff) -> None:
+        client = self.nodes.clients[diff.node]
+        for config in diff.orphans:
+            try:
+                if await client.remove_config(config):
+                    # Сироты не входили в нагрузку ноды, освобождается только порт
+                    if not config["client_id"]:
+                        self.nodes.ports[diff.node].release(config["port"])
+                    diff.fixed_orphans += 1
+            except XUIUnavailable:
+                break
+            except XUIError as e:
+                logger.warning(f"Не удалось удалить сироту {config['email']}: {str(e)}")
+
+        if diff.ghosts:
+            await self.db.deactivate_configs([config["id"] for config in diff.ghosts])
+            for config in diff.ghosts:
+                self.nodes.config_removed(config)
+            diff.fixed_ghosts = len(diff.ghosts)
+
+def format_report(diffs: List[NodeDiff], fix: bool) -> str:
+    lines = ["🔍 Сверка с панелью" + ("" if fix else " (пробный прогон, /reconcile fix - исправить)")]
+    for diff in diffs:
+        lines.append("")
+        if diff.error:
+            lines.append(f"⛔ {diff.node}: панель недоступна ({diff.error})")
+            continue
+        lines.append(f"🖥 {diff.node}: в БД {diff.db_count}, на панели {diff.panel_count}")
+        for title, items, fixed in (
+            ("Сироты на панели", diff.orphans, diff.fixed_orphans),
+            ("Призраки в БД", diff.ghosts, diff.fixed_ghosts),
+        ):
+            if not items:
+                continue
+            line = f"{title}: {len(items)}"
+            if fix:
+                line += f", исправлено {fixed}"
+            lines.append(line)
+            lines.extend(f"  • {config['email']}" for config in items[:REPORT_LIMIT])
+            if len(items) > REPORT_LIMIT:
+                lines.append(f"  … и ещё {len(items) - REPORT_LIMIT}")
+        if diff.clean:
+            lines.append("✅ Расхождений нет")
+    return "\n".join(lines)
@@ -0,0 +1,118 @@
+import asyncio
+import base64
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from config import Config
+from database import Database
+from http_server import Request, Response
+
+logger = logging.getLogger(__name__)
+
+MAX_UNKNOWN_TOKENS = 10000  # Сколько неизвестных токенов помнить, чтобы не ходить за ними в БД
+
+class Bundle:
+    """Готовый ответ подписки: base64 ссылок и ETag"""
+
+    def __init__(self, user_id: int, links: List[str]):
+        self.user_id = user_id
+        self.body = base64.b64encode("\n".join(links).encode()) if links else b""
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()[:20]}"'
+
+class SubscriptionService:
+    """Подписки пользователей для клиентов вроде V2RayTun.
+
+    Ответы для всех токенов собираются заранее и хранятся в памяти, поэтому
+    запрос клиента из кэша не обращается к SQLite, а при совпадении
+    If-None-Match отдаётся 304 без тела. При создании или удалении конфига
+    БД сообщает владельца, и его ответ пересобирается.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._bundles: Dict[str, Bundle] = {}
+        self._tokens: Dict[int, str] = {}
+        self._generation = 0
+        self._changed_at: Dict[int, int] = {}
+        self._unknown: "OrderedDict[str, None]" = OrderedDict()
+        self._tasks = set()
+        db.add_config_listener(self.invalidate)
+
+    async def warm_up(self) -> None:
+        for token, (user_id, links) in (await self.db.get_all_subscriptions()).items():
+            self._store(token, user_id, links)
+        logger.info(f"Subscription cache warmed: {len(self._bundles)} users")
+
+    def url(self, token: str) -> str:
+        return f"{Config.SUBSCRIPTION_URL.rstrip('/')}/{token}"
+
+    def _store(self, token: str, user_id: int, links: List[str]) -> None:
+        self._bundles[token] = Bundle(user_id, links)
+        self._tokens[user_id] = token
+        self._unknown.pop(token, None)
+
+    def invalidate(self, user_id: int) -> None:
+        """Пересборка ответа пользователя после изменения его конфигов"""
+        self._generation += 1
+        self._changed_at[user_id] = self._generation
+        token = self._tokens.get(user_id)
+        if token is None:
+            return
+        self._bundles.pop(token, None)
+        task = asyncio.ensure_future(self._load(token))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _load(self, token: str) -> Optional[Bundle]:
+        started = self._generation
+        subscription = await self.db.get_subscription(token)
+        if subscription is None:
+            self._unknown[token] = None
+            if len(self._unknown) > MAX_UNKNOWN_TOKENS:
+                self._unknown.popitem(last=False)
+            return None
+        user_id, links = subscription
+        # Если конфиги изменились во время чтения, в кэш попадёт пересборка из invalidate
+        if self._changed_at.get(user_id, 0) <= started:
+            self._store(token, user_id, links)
+        else:
+            self._tokens[user_id] = token
+        return Bundle(user_id, links)
+
+    async def token_for(self, user_id: int) -> str:
+        """Токен подписки пользователя; новый токен сразу попадает в кэш"""
+        token = await self.db.get_sub_token(user_id)
+        if token not in self._bundles:
+            await self._load(token)
+        return token
+
+    async def get(self, token: str) -> Optional[Bundle]:
+        bundle = self._bundles.get(token)
+        if bundle is not None:
+            return bundle
+        if token in self._unknown:
+            return None
+        return await self._load(token)
+
+    async def handle(self, request: Request) -> Response:
+        # Сервер общий с /metrics и может работать при выключенных подписках
+        if not Config.SUBSCRIPTION_ENABLED:
+            return Response(404)
+        token = request.path.rsplit("/", 1)[-1]
+        bundle = await self.get(token) if token else None
+        if bundle is None:
+            return Response(404)
+
+        headers = {
+            "ETag": bundle.etag,
+            "Cache-Control": "no-cache",
+            "Content-Type": "text/plain; charset=utf-8",
+            "Profile-Update-Interval": str(Config.SUBSCRIPTION_UPDATE_INTERVAL),
+        }
+        if request.headers.get("if-none-match") == bundle.etag:
+            return Response(304, headers=headers)
+        return Response(200, bundle.body, headers)
+
+    async def stop(self) -> None:
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,93 @@
+"""Замер скорости аналитики трафика на синтетических снимках.
+
+Генерирует историю накопительных счётчиков для заданного числа конфигов,
+записывает её во временную SQLite с рабочей схемой и проходит тот же путь,
+что /top и /traffic: загрузка из БД, агрегация и повторный запрос из кэша.
+Пример:
+
+    python tools/bench_analytics.py --configs 20000 --hours 168
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import AnalyticsCache, _columns  # noqa: E402
+from database import Database  # noqa: E402
+
+
+def generate(configs: int, hours: int, users: int, seed: int) -> tuple:
+    rng = np.random.default_rng(seed)
+    emails = [f"user{i:08x}@bench" for i in range(configs)]
+    usage = rng.exponential(50_000_000, size=(configs, hours)).astype(np.int64)
+    totals = np.cumsum(usage, axis=1)
+    owners = rng.integers(1, users + 1, configs)
+    return emails, totals, owners
+
+
+async def fill(db: Database, emails: list, totals: np.ndarray, owners: np.ndarray, since: int) -> None:
+    def insert(conn) -> None:
+        conn.executemany(
+            "INSERT INTO traffic_snapshots (email, bucket, up, down) VALUES (?, ?, 0, ?)",
+            ((email, since + hour, int(total)) for email, row in zip(emails, totals) for hour, total in enumerate(row))
+        )
+        conn.executemany(
+            "INSERT INTO configs (id, user_id, email, is_active) VALUES (?, ?, ?, 0)",
+            ((f"cfg-{i}", int(owner), email) for i, (email, owner) in enumerate(zip(emails, owners)))
+        )
+    # Запись напрямую через писателя: генерация не должна попадать в замер
+    await db._write(insert)
+
+
+async def timed(label: str, coro):
+    started = time.perf_counter()
+    result = await coro
+    print(f"{label:<20} {(time.perf_counter() - started) * 1000:8.1f} мс")
+    return result
+
+
+async def bench(args) -> None:
+    emails, totals, owners = generate(args.configs, args.hours, args.users, args.seed)
+    days = (args.hours + 23) // 24
+    first_bucket = int((time.time() - days * 86400) // 3600) + 1
+
+    path = os.path.join(tempfile.mkdtemp(prefix="vpnbot-analytics-"), "bench.db")
+    db = Database(path)
+    await fill(db, emails, totals, owners, first_bucket)
+    # Переоткрытие переносит WAL в основной файл, как это делает автоматический checkpoint в работе
+    await db.close()
+    db = Database(path)
+    print(f"Снимков: {totals.size:,}, конфигов: {args.configs:,}, пользователей: {args.users:,}")
+
+    since = int((time.time() - days * 86400) // 3600)
+    await timed("чтение из SQLite", db.get_traffic_samples(since, _columns))
+    cache = AnalyticsCache(db)
+    analytics = await timed("/top (из БД)", cache.get(days, synced_at=1.0))
+    await timed("/top (из кэша)", cache.get(days, synced_at=1.0))
+    started = time.perf_counter()
+    analytics.top_users(args.top)
+    analytics.daily_totals()
+    analytics.percentiles()
+    analytics.growth()
+    print(f"{'отчёты':<20} {(time.perf_counter() - started) * 1000:8.1f} мс")
+    await db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", type=int, default=20000)
+    parser.add_argument("--hours", type=int, default=168, help="Снимков на конфиг (часов истории)")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
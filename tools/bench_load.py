@@ -0,0 +1,309 @@
+"""Нагрузочный тест бота с локальными заглушками 3X-UI и Telegram Bot API.
+
+Поднимает фейковую панель (login, inbounds/add, list, del) с настраиваемыми
+задержкой и долей ошибок и фейковый Bot API, затем прогоняет через VPNBot
+синтетические апдейты /start, create, list, view_, delete_ и confirm_ от
+множества пользователей. Для каждой фазы печатает пропускную способность и
+p50/p95/p99 времени обработчика, для создания и удаления - время до ответа
+пользователю (после выполнения задачи), в конце - пиковую память. Пример:
+
+    python tools/bench_load.py --users 2000 --concurrency 200 --panel-latency 0.05
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from http_server import HTTPServer, Request, Response  # noqa: E402
+
+PANEL_PORT = 18550
+TELEGRAM_PORT = 18551
+TOKEN = "123456:bench"
+
+
+def json_response(data, status: int = 200, headers: dict = None) -> Response:
+    headers = dict(headers or {})
+    headers["Content-Type"] = "application/json"
+    return Response(status, json.dumps(data).encode(), headers)
+
+
+def form_fields(request: Request) -> dict:
+    """Поля запроса: urlencoded, JSON или multipart (только текстовые)"""
+    content_type = request.headers.get("content-type", "")
+    if "multipart/form-data" in content_type:
+        text = request.body.decode("latin-1")
+        return dict(re.findall(r'name="([^"]+)"\r\n(?:[^\r\n]+\r\n)*\r\n([^\r\n]*)', text))
+    if "application/json" in content_type:
+        return json.loads(request.body or b"{}")
+    return {key: values[0] for key, values in parse_qs(request.body.decode()).items()}
+
+
+class FakePanel:
+    """Заглушка 3X-UI: хранит inbound в памяти"""
+
+    def __init__(self, latency: float, failure_rate: float):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.inbounds = {}
+        self._ids = itertools.count(1)
+        self.calls = 0
+
+    def register(self, server: HTTPServer) -> None:
+        server.route("/login", self.login, methods=("POST",))
+        server.route("/panel/api/inbounds/", self.inbounds_api, methods=("GET", "POST"))
+
+    async def login(self, request: Request) -> Response:
+        return json_response({"success": True}, headers={"Set-Cookie": "3x-ui=bench; Path=/"})
+
+    async def inbounds_api(self, request: Request) -> Response:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if random.random() < self.failure_rate:
+            return Response(500, b"fake failure")
+
+        action = request.path[len("/panel/api/inbounds/"):]
+        if action == "list":
+            return json_response({"success": True, "obj": list(self.inbounds.values())})
+        if action == "add":
+            fields = form_fields(request)
+            inbound_id = next(self._ids)
+            self.inbounds[inbound_id] = {
+                "id": inbound_id, "port": int(fields["port"]),
+                "remark": fields.get("remark", ""), "settings": fields.get("settings", "{}")
+            }
+            return json_response({"success": True, "obj": {"id": inbound_id}})
+        if action.startswith("del/"):
+            self.inbounds.pop(int(action[4:]), None)
+        return json_response({"success": True})
+
+
+class FakeTelegram:
+    """Заглушка Bot API: отвечает успешно и запоминает время ответов пользователям"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self._message_ids = itertools.count(1_000_000)
+        self.photos = {}
+        self.deleted = {}
+        self.calls = 0
+
+    def register(self, server: HTTPServer) -> None:
+        server.route("/bot", self.handle, methods=("GET", "POST"))
+
+    def _message(self, chat_id, **extra) -> dict:
+        message = {
+            "message_id": next(self._message_ids), "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"}
+        }
+        message.update(extra)
+        return message
+
+    async def handle(self, request: Request) -> Response:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        method = request.path.rsplit("/", 1)[-1]
+        fields = form_fields(request)
+        chat_id = fields.get("chat_id", 0)
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "sendPhoto":
+            self.photos[int(chat_id)] = time.perf_counter()
+            result = self._message(chat_id, photo=[
+                {"file_id": f"photo-{chat_id}", "file_unique_id": f"u-{chat_id}", "width": 1, "height": 1}
+            ])
+        elif method in ("sendMessage", "editMessageText"):
+            text = fields.get("text", "")
+            if "удален" in text:
+                self.deleted[int(chat_id)] = time.perf_counter()
+            result = self._message(chat_id, text=text)
+        else:
+            result = True
+        return json_response({"ok": True, "result": result})
+
+
+def percentile(values: list, q: float) -> float:
+    return values[min(int(q * len(values)), len(values) - 1)] * 1000 if values else 0.0
+
+
+def report(title: str, latencies: list, elapsed: float) -> None:
+    latencies.sort()
+    rate = len(latencies) / elapsed if elapsed > 0 else 0
+    print(f"{title:<18} {len(latencies):>7} {rate:>9.1f}/с   "
+          f"p50 {percentile(latencies, 0.5):7.1f}  p95 {percentile(latencies, 0.95):7.1f}  "
+          f"p99 {percentile(latencies, 0.99):7.1f} мс")
+
+
+class Driver:
+    """Генерация апдейтов и замер времени обработки"""
+
+    def __init__(self, bot, concurrency: int):
+        from telegram import Update
+        self.bot = bot
+        self.update_cls = Update
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.errors = 0
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id: int, text: str = None) -> dict:
+        message = {
+            "message_id": next(self._message_ids), "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id)
+        }
+        if text:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    def command(self, user_id: int, text: str) -> dict:
+        return {"update_id": next(self._update_ids), "message": self._message(user_id, text)}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        return {"update_id": next(self._update_ids), "callback_query": {
+            "id": str(next(self._update_ids)), "from": self._user(user_id), "chat_instance": str(user_id),
+            "data": data, "message": self._message(user_id, "menu")
+        }}
+
+    async def run(self, title: str, updates: list) -> None:
+        latencies = []
+        app = self.bot.app
+
+        async def process(data: dict) -> None:
+            async with self.semaphore:
+                update = self.update_cls.de_json(data, app.bot)
+                started = time.perf_counter()
+                await app.process_update(update)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(process(update) for update in updates))
+        report(title, latencies, time.perf_counter() - started)
+
+
+async def wait_for(results: dict, users: list, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and any(user not in results for user in users):
+        await asyncio.sleep(0.05)
+
+
+async def bench(args) -> None:
+    panel = FakePanel(args.panel_latency, args.panel_failure_rate)
+    telegram = FakeTelegram(args.telegram_latency)
+    panel_server = HTTPServer("127.0.0.1", PANEL_PORT)
+    panel.register(panel_server)
+    telegram_server = HTTPServer("127.0.0.1", TELEGRAM_PORT)
+    telegram.register(telegram_server)
+    await panel_server.start()
+    await telegram_server.start()
+
+    from bot import VPNBot
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    started = time.perf_counter()
+    bot = VPNBot()
+    driver = Driver(bot, args.concurrency)
+
+    async def count_error(update, context) -> None:
+        driver.errors += 1
+    bot.app.add_error_handler(count_error)
+
+    await bot.app.initialize()
+    await bot._post_init(bot.app)
+    print(f"Запуск бота: {(time.perf_counter() - started) * 1000:.0f} мс")
+    print(f"{'фаза':<18} {'апдейтов':>7} {'скорость':>11}   время обработчика")
+
+    users = list(range(100_000, 100_000 + args.users))
+    await driver.run("/start", [driver.command(user, "/start") for user in users])
+
+    create_started = time.perf_counter()
+    await driver.run("create", [driver.callback(user, "create") for user in users])
+    await wait_for(telegram.photos, users, args.timeout)
+    report("  → конфиг готов", [telegram.photos[u] - create_started for u in users if u in telegram.photos],
+           time.perf_counter() - create_started)
+
+    configs = {}
+    for user in users:
+        rows = await bot.db.get_user_configs(user)
+        if rows:
+            configs[user] = rows[0]["id"]
+    await driver.run("list", [driver.callback(user, "list") for user in users])
+    await driver.run("view_", [driver.callback(user, f"view_{cid}") for user, cid in configs.items()])
+    await driver.run("delete_", [driver.callback(user, f"delete_{cid}") for user, cid in configs.items()])
+
+    delete_started = time.perf_counter()
+    await driver.run("confirm_", [driver.callback(user, f"confirm_{cid}") for user, cid in configs.items()])
+    await wait_for(telegram.deleted, list(configs), args.timeout)
+    report("  → конфиг удалён", [telegram.deleted[u] - delete_started for u in configs if u in telegram.deleted],
+           time.perf_counter() - delete_started)
+
+    await bot._post_shutdown(bot.app)
+    await bot.app.shutdown()
+    await panel_server.stop()
+    await telegram_server.stop()
+
+    print(f"\nОшибок обработчиков: {driver.errors}, вызовов панели: {panel.calls}, Bot API: {telegram.calls}")
+    print(f"Конфигов создано: {len(telegram.photos)}/{len(users)}, удалено: {len(telegram.deleted)}/{len(configs)}")
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"Память Python: пик {peak / 1024 / 1024:.1f} МБ, в конце {current / 1024 / 1024:.1f} МБ")
+
+    from perf import metrics
+    print("\n" + metrics.report(limit=15))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="Апдейтов в обработке одновременно")
+    parser.add_argument("--panel-latency", type=float, default=0.02, help="Средняя задержка панели, с")
+    parser.add_argument("--panel-failure-rate", type=float, default=0.0, help="Доля ответов 500 от панели")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="Задержка Bot API, с")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Ожидание выполнения задач, с")
+    parser.add_argument("--no-tracemalloc", action="store_true",
+                        help="Не замерять память (tracemalloc замедляет бота в 2-3 раза)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="vpnbot-bench-")
+    # Настройки задаются до импорта бота: Database берёт путь к БД из Config при импорте
+    Config.TOKEN = TOKEN
+    Config.TELEGRAM_BASE_URL = f"http://127.0.0.1:{TELEGRAM_PORT}/bot"
+    Config.XUI_URL = f"http://127.0.0.1:{PANEL_PORT}"
+    Config.XUI_SESSION_FILE = None
+    Config.NODES = []
+    Config.DB_PATH = os.path.join(workdir, "bench.db")
+    Config.ADMIN_IDS = []
+    Config.PORT_SYNC_WITH_PANEL = False
+    Config.RECONCILE_INTERVAL = 0
+    Config.DEFAULT_EXPIRE_DAYS = 0
+    Config.SUBSCRIPTION_ENABLED = False
+    Config.TRAFFIC_SYNC_INTERVAL = 24 * 60 * 60
+    Config.JOB_RETRY_BASE_DELAY = 0.1
+    Config.PERF_SLOW_THRESHOLD = 10.0
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Отправка записанных апдейтов Telegram на webhook бота.
+
+Файл содержит по одному JSON-объекту Update на строку (как в ответе
+getUpdates). Пример:
+
+    python tools/replay_updates.py updates.jsonl --url http://127.0.0.1:8080/telegram --secret s3cr3t
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import httpx
+
+
+async def replay(url: str, secret: str, updates: list, concurrency: int) -> None:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failed = 0
+
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        async def send(update: dict) -> None:
+            nonlocal failed
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json=update, headers=headers)
+                    if response.status_code != 200:
+                        failed += 1
+                except httpx.HTTPError:
+                    failed += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+    print(f"Отправлено: {len(updates)}, ошибок: {failed}, за {elapsed:.2f} с "
+          f"({len(updates) / elapsed:.1f} апдейтов/с), p50 {p50:.1f} мс")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="JSON Lines с апдейтами")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram")
+    parser.add_argument("--secret", default=None, help="WEBHOOK_SECRET бота")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=1, help="Повторить набор апдейтов N раз")
+    args = parser.parse_args()
+
+    with open(args.file, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    if not updates:
+        sys.exit("Файл не содержит апдейтов")
+
+    batch = []
+    for i in range(args.repeat):
+        for update in updates:
+            update = dict(update)
+            update["update_id"] = update.get("update_id", 0) + i * len(updates)
+            batch.append(update)
+
+    asyncio.run(replay(args.url, args.secret, batch, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from database import Database
+from nodes import NodePool
+from xui_client import XUIError, XUIUnavailable
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+def format_bytes(size: float) -> str:
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ТБ"
+
+class TrafficMonitor:
+    """Фоновая синхронизация трафика клиентов с панелей.
+
+    Раз в TRAFFIC_SYNC_INTERVAL у каждой ноды одним запросом берётся список
+    inbound со статистикой клиентов. Счётчики сохраняются в БД снимками (одна
+    строка на конфиг за TRAFFIC_BUCKET_SECONDS) и держатся в памяти - бот
+    показывает трафик только из кэша и не обращается к панели по запросу
+    пользователя.
+    """
+
+    def __init__(self, db: Database, nodes: NodePool):
+        self.db = db
+        self.nodes = nodes
+        self.usage: Dict[str, Tuple[int, int]] = {}
+        self.recent: Dict[str, int] = {}
+        self.node_of: Dict[str, str] = {}
+        self.updated_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _bucket(timestamp: float) -> int:
+        return int(timestamp // Config.TRAFFIC_BUCKET_SECONDS)
+
+    async def start(self) -> None:
+        """Загрузка последних снимков из БД и запуск синхронизации"""
+        for row in await self.db.get_latest_traffic():
+            self.usage[row["email"]] = (row["up"], row["down"])
+        self.recent = await self.db.get_traffic_growth(self._bucket(time.time() - DAY))
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации трафика: {str(e)}", exc_info=True)
+            await asyncio.sleep(Config.TRAFFIC_SYNC_INTERVAL)
+
+    async def sync(self) -> None:
+        """Один проход по всем нодам"""
+        now = time.time()
+        traffic = {}
+        for name, client in self.nodes.clients.items():
+            try:
+                stats = await client.client_traffic()
+            except XUIError as e:
+                if not isinstance(e, XUIUnavailable):
+                    logger.warning(f"Не удалось получить трафик ноды {name}: {str(e)}")
+                continue
+            traffic.update(stats)
+            self.node_of.update((email, name) for email in stats)
+
+        keep_after = self._bucket(now - Config.TRAFFIC_RETENTION_DAYS * DAY)
+        await self.db.save_traffic(self._bucket(now), traffic, keep_after)
+        self.usage.update(traffic)
+        self.recent = await self.db.get_traffic_growth(self._bucket(now - DAY))
+        self.nodes.set_recent_traffic({name: day for name, (_, day) in self._node_totals().items()})
+        self.updated_at = now
+        logger.info(f"Traffic synced for {len(traffic)} clients in {time.time() - now:.2f} s")
+
+    def config_usage(self, email: str) -> Optional[str]:
+        """Строка с трафиком конфига для пользователя (None - данных ещё нет)"""
+        if email not in self.usage:
+            return None
+        up, down = self.usage[email]
+        line = f"↓ {format_bytes(down)} ↑ {format_bytes(up)}"
+        if email in self.recent:
+            line += f", за 24 ч: {format_bytes(self.recent[email])}"
+        return line
+
+    def _node_totals(self) -> Dict[str, List[int]]:
+        """{нода: [трафик всего, трафик за 24 ч]}"""
+        totals = {name: [0, 0] for name in self.nodes.clients}
+        for email, (up, down) in self.usage.items():
+            name = self.node_of.get(email)
+            if name in totals:
+                totals[name][0] += up + down
+                totals[name][1] += self.recent.get(email, 0)
+        return totals
+
+    def node_lines(self) -> List[str]:
+        """Суммарный трафик по нодам для админ-панели"""
+        return [
+            f"{name}: всего {format_bytes(total)}, за 24 ч {format_bytes(day)}"
+            for name, (total, day) in self._node_totals().items()
+        ]
+
+    @property
+    def age(self) -> Optional[float]:
+        """Сколько секунд назад обновлялся кэш"""
+        return time.time() - self.updated_at if self.updated_at else None
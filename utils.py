@@ -1,4 +1,4 @@
-import qrcode
+import qr
 import io
 import uuid
 from datetime import datetime
@@ -7,23 +7,7 @@ from xui import XUIHelper
 
 def generate_qr(config_text: str) -> io.BytesIO:
     """Генерирует QR-код из конфига"""
-    try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(config_text)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        byte_io = io.BytesIO()
-        img.save(byte_io, 'PNG')
-        byte_io.seek(0)
-        return byte_io
-    except Exception as e:
-        raise Exception(f"Ошибка генерации QR: {str(e)}")
+    return qr.generate_qr(config_text)
 
 def generate_config(user_id: int, config_name: str = None) -> tuple:
     """Генерирует конфиг и добавляет его в X-UI"""
@@ -1,40 +1,199 @@
+import asyncio
 import httpx
+import os
 import random
 import json
+import time
+from typing import Dict, Optional, Tuple
 from uuid import uuid4
 from config import Config
+from perf import metrics, path_name
 import logging
-import qrcode
-import io
 
 logger = logging.getLogger(__name__)
 
+REMARK_PREFIX = "VPN-"
+SHARED_REMARK_PREFIX = "VPN-shared-"
+
 class XUIError(Exception):
     """Ошибки API 3X-UI"""
     pass
 
+class XUIUnavailable(XUIError):
+    """Панель недоступна: circuit breaker разомкнут, запрос не отправлялся"""
+    pass
+
+class CircuitBreaker:
+    """Circuit breaker для запросов к панели.
+
+    После threshold ошибок подряд цепь размыкается и запросы сразу отклоняются.
+    Через reset_timeout пропускается один пробный запрос (half-open): успех
+    замыкает цепь, ошибка снова размыкает её.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_started = None
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_started = None
+        return self._state
+
+    @property
+    def retry_in(self) -> float:
+        """Секунд до следующего пробного запроса"""
+        if self.state != self.OPEN:
+            return 0.0
+        return self.reset_timeout - (time.monotonic() - self._opened_at)
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN:
+            return False
+        # Пробный запрос, зависший дольше reset_timeout, не должен блокировать цепь навсегда
+        now = time.monotonic()
+        if self._probe_started is None or now - self._probe_started >= self.reset_timeout:
+            self._probe_started = now
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self._state != self.CLOSED:
+            logger.info("Circuit breaker closed")
+        self.failures = 0
+        self._state = self.CLOSED
+        self._probe_started = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self._state != self.OPEN:
+                logger.warning(f"Circuit breaker opened after {self.failures} failures")
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_started = None
+
+DEFAULT_NODE = "main"
+
+def node_settings() -> list:
+    """Настройки всех панелей: записи Config.NODES поверх общих параметров.
+    Без Config.NODES - одна нода "main" из XUI_*/Reality/SERVER_IP."""
+    base = {
+        "name": DEFAULT_NODE,
+        "url": Config.XUI_URL,
+        "login": Config.XUI_LOGIN,
+        "password": Config.XUI_PASSWORD,
+        "server_ip": Config.SERVER_IP,
+        "public_key": Config.PUBLIC_KEY,
+        "private_key": Config.PRIVATE_KEY,
+        "short_id": Config.SHORT_ID,
+        "server_names": Config.SERVER_NAMES,
+        "weight": 1.0
+    }
+    if not Config.NODES:
+        return [base]
+    return [{**base, **node} for node in Config.NODES]
+
 class XUIClient:
-    def __init__(self):
-        self.base_url = Config.XUI_URL.rstrip('/')
-        self.session = httpx.AsyncClient(
-            verify=False,
-            timeout=30.0,
-            headers={
-                'Content-Type': 'application/x-www-form-urlencoded',
-                'Accept': 'application/json'
-            }
-        )
-        
+    def __init__(self, node: dict = None):
+        node = node or node_settings()[0]
+        self.name = node["name"]
+        self.base_url = node["url"].rstrip('/')
+        self.login = node["login"]
+        self.password = node["password"]
+        self.server_ip = node["server_ip"]
+        self.public_key = node["public_key"]
+        self.private_key = node["private_key"]
+        self.short_id = node["short_id"]
+        self.server_names = node["server_names"]
+        self._session: Optional[httpx.AsyncClient] = None
+        self._cookies = httpx.Cookies()
+        self.session_file = Config.XUI_SESSION_FILE
+        if self.session_file and self.name != DEFAULT_NODE:
+            root, ext = os.path.splitext(self.session_file)
+            self.session_file = f"{root}.{self.name}{ext}"
+        self.breaker = CircuitBreaker(Config.XUI_BREAKER_THRESHOLD, Config.XUI_BREAKER_RESET_TIMEOUT)
+        self._login_lock = asyncio.Lock()
+        self._authenticated = False
+        self._session_generation = 0
+        self._shared_lock = asyncio.Lock()
+        self._shared_inbounds = {}
+        self._load_session()
+
+    @property
+    def session(self) -> httpx.AsyncClient:
+        """HTTP-клиент создаётся при первом запросе: SSL-контекст дорогой и при старте не нужен"""
+        if self._session is None:
+            self._session = httpx.AsyncClient(
+                verify=False,
+                timeout=Config.XUI_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=Config.XUI_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.XUI_MAX_CONNECTIONS
+                ),
+                headers={
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                    'Accept': 'application/json'
+                },
+                cookies=self._cookies
+            )
+        return self._session
+
+    def _load_session(self) -> None:
+        """Восстановление cookie панели, сохранённых при прошлом запуске"""
+        if not self.session_file or not os.path.exists(self.session_file):
+            return
+        try:
+            with open(self.session_file, "r", encoding="utf-8") as f:
+                cookies = json.load(f)
+            for cookie in cookies:
+                self._cookies.set(
+                    cookie["name"], cookie["value"],
+                    domain=cookie.get("domain", ""), path=cookie.get("path", "/")
+                )
+            self._authenticated = bool(cookies)
+            logger.info(f"Restored 3X-UI session from {self.session_file}")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Не удалось загрузить сессию 3X-UI: {str(e)}")
+
+    def _save_session(self) -> None:
+        """Сохранение cookie панели на диск"""
+        if not self.session_file:
+            return
+        cookies = [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+            for c in self.session.cookies.jar
+        ]
+        try:
+            fd = os.open(self.session_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(cookies, f)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить сессию 3X-UI: {str(e)}")
+
     async def _login(self) -> None:
         try:
             login_url = f"{self.base_url}/login"
-            logger.info(f"Attempting login to: {login_url}")
+            logger.info(f"[{self.name}] Attempting login to: {login_url}")
             
             response = await self.session.post(
                 login_url,
                 data={
-                    "username": Config.XUI_LOGIN,
-                    "password": Config.XUI_PASSWORD
+                    "username": self.login,
+                    "password": self.password
                 },
                 follow_redirects=True
             )
@@ -42,144 +201,329 @@ class XUIClient:
             if response.status_code != 200:
                 logger.error(f"Login failed. Status: {response.status_code}, Response: {response.text[:200]}")
                 raise XUIError("Ошибка аутентификации в 3X-UI")
+
+            try:
+                success = response.json().get("success", False)
+            except (json.JSONDecodeError, AttributeError):
+                success = False
+            if not success:
+                logger.error(f"Login rejected: {response.text[:200]}")
+                raise XUIError("Неверный логин или пароль 3X-UI")
                 
         except Exception as e:
+            self._authenticated = False
             logger.error(f"Connection error during login: {str(e)}")
             raise XUIError(f"Ошибка подключения: {str(e)}")
 
-    async def create_inbound(self, port: int) -> dict:
-        """Создание нового Reality inbound"""
-        try:
+        self._authenticated = True
+        self._session_generation += 1
+        self._save_session()
+
+    async def _ensure_session(self, generation: int) -> None:
+        """Авторизация под блокировкой: из параллельных запросов логинится только один"""
+        async with self._login_lock:
+            if self._authenticated and self._session_generation != generation:
+                # Пока ждали блокировку, сессию уже обновил другой запрос
+                return
             await self._login()
-            
-            email = f"user{random.randint(1000, 9999)}@{Config.DOMAIN}"
-            uuid_str = str(uuid4())
-            
-            data = {
-                "up": 0,
-                "down": 0,
-                "total": 0,
-                "remark": f"VPN-{email[:10]}",
-                "enable": True,
-                "expiryTime": 0,
-                "listen": "",
-                "port": port,
-                "protocol": "vless",
-                "settings": json.dumps({
-                    "clients": [{
-                        "id": uuid_str,
-                        "flow": Config.DEFAULT_FLOW,
-                        "email": email,
-                        "limitIp": 0,
-                        "totalGB": 0
-                    }],
-                    "decryption": "none"
-                }),
-                "streamSettings": json.dumps({
-                    "network": "tcp",
-                    "security": "reality",
-                    "realitySettings": {
-                        "show": False,
-                        "dest": f"{random.choice(Config.SERVER_NAMES)}:443",
-                        "serverNames": Config.SERVER_NAMES,
-                        "privateKey": Config.PRIVATE_KEY,
-                        "shortIds": [Config.SHORT_ID]
-                    }
-                })
-            }
-            
-            api_url = f"{self.base_url}/panel/api/inbounds/add"
-            logger.info(f"Creating inbound at: {api_url}")
-            
-            response = await self.session.post(
-                api_url,
-                data=data,
-                follow_redirects=True
+
+    @staticmethod
+    def _session_expired(response: httpx.Response) -> bool:
+        """Признаки протухшей сессии: 401/403, редирект на страницу входа
+        или 404, которым новые версии 3X-UI отвечают на API без авторизации"""
+        if response.status_code in (401, 403, 404):
+            return True
+        return bool(response.history) and "/panel/api/" not in response.url.path
+
+    async def _request(self, method: str, path: str, idempotent: bool = False, **kwargs) -> httpx.Response:
+        """Запрос к API панели через circuit breaker.
+
+        Идемпотентные запросы при сетевых ошибках и 5xx повторяются с
+        экспоненциальной задержкой и джиттером; создание inbound/клиента
+        не повторяется, чтобы не получить дубликат на панели.
+        """
+        if not self.breaker.allow():
+            raise XUIUnavailable(
+                f"Сервер {self.name} временно недоступен, повторите через {max(self.breaker.retry_in, 1):.0f} с"
             )
-            
-            logger.debug(f"API Response: Status={response.status_code}, Text={response.text[:200]}")
-            
-            if response.status_code != 200:
-                error_msg = f"Ошибка API ({response.status_code}): {response.text[:200]}"
-                logger.error(error_msg)
-                raise XUIError(error_msg)
-                
+
+        attempts = Config.XUI_RETRIES + 1 if idempotent else 1
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(random.uniform(0, Config.XUI_RETRY_BASE_DELAY * 2 ** attempt))
             try:
-                response_data = response.json()
-                if not response_data.get("success", False):
-                    error_msg = response_data.get("msg", "Unknown error from X-UI")
-                    raise XUIError(f"API Error: {error_msg}")
-                
-                inbound_id = response_data.get("obj", {}).get("id")
-                if not inbound_id:
-                    raise XUIError("Не удалось получить ID созданного inbound")
-                    
-                config_data = self._generate_config(uuid_str, port, email)
-                qr_code = self._generate_qr_code(config_data)
-                    
-                return {
-                    "inbound_id": inbound_id,
-                    "uuid": uuid_str,
-                    "port": port,
-                    "email": email,
-                    "flow": Config.DEFAULT_FLOW,
-                    "data": config_data,
-                    "qr_code": qr_code
+                response = await self._send(method, path, **kwargs)
+            except (httpx.TransportError, XUIError) as e:
+                error = XUIError(f"Ошибка подключения: {str(e)}")
+                continue
+            if response.status_code < 500:
+                self.breaker.record_success()
+                return response
+            error = XUIError(f"Ошибка API ({response.status_code}): {response.text[:200]}")
+
+        self.breaker.record_failure()
+        raise error
+
+    async def _send(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Запрос к API панели с переиспользованием сессии и однократным перелогином"""
+        if not self._authenticated:
+            await self._ensure_session(self._session_generation)
+
+        generation = self._session_generation
+        url = f"{self.base_url}{path}"
+        op = f"xui.{self.name}.{method} {path_name(path)}"
+        with metrics.timer(op):
+            response = await self.session.request(method, url, follow_redirects=True, **kwargs)
+
+        if self._session_expired(response):
+            logger.info("3X-UI session expired, re-authenticating")
+            await self._ensure_session(generation)
+            with metrics.timer(op):
+                response = await self.session.request(method, url, follow_redirects=True, **kwargs)
+
+        return response
+
+    def _parse_response(self, response: httpx.Response) -> dict:
+        """Проверка ответа API 3X-UI, возвращает поле obj"""
+        logger.debug(f"API Response: Status={response.status_code}, Text={response.text[:200]}")
+
+        if response.status_code != 200:
+            error_msg = f"Ошибка API ({response.status_code}): {response.text[:200]}"
+            logger.error(error_msg)
+            raise XUIError(error_msg)
+
+        try:
+            response_data = response.json()
+        except json.JSONDecodeError:
+            logger.error(f"Invalid response format: {response.text[:200]}")
+            raise XUIError("Неверный формат ответа от сервера X-UI")
+
+        if not response_data.get("success", False):
+            error_msg = response_data.get("msg", "Unknown error from X-UI")
+            raise XUIError(f"API Error: {error_msg}")
+
+        return response_data.get("obj") or {}
+
+    @staticmethod
+    def new_client() -> dict:
+        """Новый клиент VLESS с уникальными id и email"""
+        return {
+            "id": str(uuid4()),
+            "flow": Config.DEFAULT_FLOW,
+            "email": f"user{uuid4().hex[:8]}@{Config.DOMAIN}",
+            "limitIp": 0,
+            "totalGB": 0,
+            "expiryTime": 0,
+            "enable": True
+        }
+
+    def _inbound_payload(self, port: int, remark: str, clients: list) -> dict:
+        """Параметры Reality inbound для /panel/api/inbounds/add"""
+        return {
+            "up": 0,
+            "down": 0,
+            "total": 0,
+            "remark": remark,
+            "enable": True,
+            "expiryTime": 0,
+            "listen": "",
+            "port": port,
+            "protocol": "vless",
+            "settings": json.dumps({
+                "clients": clients,
+                "decryption": "none"
+            }),
+            "streamSettings": json.dumps({
+                "network": "tcp",
+                "security": "reality",
+                "realitySettings": {
+                    "show": False,
+                    "dest": f"{random.choice(self.server_names)}:443",
+                    "serverNames": self.server_names,
+                    "privateKey": self.private_key,
+                    "shortIds": [self.short_id]
                 }
+            })
+        }
+
+    def _config_result(self, inbound_id: int, client: dict, port: int, client_id: str = None) -> dict:
+        """Данные созданного конфига для сохранения в БД"""
+        return {
+            "node": self.name,
+            "inbound_id": inbound_id,
+            "client_id": client_id,
+            "uuid": client["id"],
+            "port": port,
+            "email": client["email"],
+            "flow": Config.DEFAULT_FLOW,
+            "data": self._generate_config(client["id"], port, client["email"])
+        }
+
+    async def create_inbound(self, port: int, client: dict = None) -> dict:
+        """Создание нового Reality inbound"""
+        try:
+            client = client or self.new_client()
+            data = self._inbound_payload(port, f"{REMARK_PREFIX}{client['email'][:10]}", [client])
+            
+            logger.info(f"Creating inbound on port {port}")
+            response = await self._request("POST", "/panel/api/inbounds/add", data=data)
+            
+            inbound_id = self._parse_response(response).get("id")
+            if not inbound_id:
+                raise XUIError("Не удалось получить ID созданного inbound")
                 
-            except (json.JSONDecodeError, AttributeError) as e:
-                logger.error(f"Invalid response format: {response.text[:200]}")
-                raise XUIError("Неверный формат ответа от сервера X-UI")
+            return self._config_result(inbound_id, client, port)
             
+        except XUIUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error in create_inbound: {str(e)}", exc_info=True)
             raise XUIError(f"Ошибка создания inbound: {str(e)}")
 
+    async def list_inbounds(self) -> list:
+        """Список всех inbound панели одним запросом"""
+        response = await self._request("GET", "/panel/api/inbounds/list", idempotent=True)
+        return self._parse_response(response) or []
+
+    async def client_traffic(self) -> Dict[str, Tuple[int, int]]:
+        """Трафик всех клиентов панели {email: (up, down)} одним запросом"""
+        try:
+            inbounds = await self.list_inbounds()
+        except XUIUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error loading traffic: {str(e)}")
+            raise XUIError(f"Ошибка загрузки трафика: {str(e)}")
+        traffic = {}
+        for inbound in inbounds:
+            for stats in inbound.get("clientStats") or []:
+                traffic[stats["email"]] = (stats.get("up", 0), stats.get("down", 0))
+        return traffic
+
+    async def _ensure_shared_inbounds(self) -> None:
+        """Поиск или создание пула общих inbound для режима shared"""
+        async with self._shared_lock:
+            if self._shared_inbounds:
+                return
+
+            shared = {}
+            for inbound in await self.list_inbounds():
+                if not inbound.get("remark", "").startswith(SHARED_REMARK_PREFIX):
+                    continue
+                clients = json.loads(inbound.get("settings") or "{}").get("clients", [])
+                shared[inbound["port"]] = {"id": inbound["id"], "port": inbound["port"], "clients": len(clients)}
+
+            for port in Config.SHARED_INBOUND_PORTS:
+                if port in shared:
+                    continue
+                logger.info(f"Creating shared inbound on port {port}")
+                data = self._inbound_payload(port, f"{SHARED_REMARK_PREFIX}{port}", [])
+                response = await self._request("POST", "/panel/api/inbounds/add", data=data)
+                inbound_id = self._parse_response(response).get("id")
+                if not inbound_id:
+                    raise XUIError("Не удалось получить ID созданного inbound")
+                shared[port] = {"id": inbound_id, "port": port, "clients": 0}
+
+            self._shared_inbounds = {item["id"]: item for item in shared.values()}
+
+    async def add_client(self, client: dict = None) -> dict:
+        """Добавление клиента в наименее загруженный общий inbound"""
+        try:
+            await self._ensure_shared_inbounds()
+            inbound = min(self._shared_inbounds.values(), key=lambda item: item["clients"])
+            client = client or self.new_client()
+
+            response = await self._request(
+                "POST", "/panel/api/inbounds/addClient",
+                data={"id": inbound["id"], "settings": json.dumps({"clients": [client]})}
+            )
+            self._parse_response(response)
+            inbound["clients"] += 1
+
+            return self._config_result(inbound["id"], client, inbound["port"], client_id=client["id"])
+
+        except XUIUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error in add_client: {str(e)}", exc_info=True)
+            raise XUIError(f"Ошибка добавления клиента: {str(e)}")
+
+    async def list_configs(self) -> Dict[str, dict]:
+        """Все конфиги бота на панели {email: конфиг} одним запросом"""
+        configs = {}
+        for inbound in await self.list_inbounds():
+            remark = inbound.get("remark", "")
+            if not remark.startswith(REMARK_PREFIX):
+                continue
+            shared = remark.startswith(SHARED_REMARK_PREFIX)
+            for client in json.loads(inbound.get("settings") or "{}").get("clients", []):
+                configs[client["email"]] = self._config_result(
+                    inbound["id"], client, inbound["port"],
+                    client_id=client["id"] if shared else None
+                )
+        return configs
+
+    async def find_config(self, email: str) -> Optional[dict]:
+        """Поиск на панели конфига, созданного с этим email (восстановление после сбоя)"""
+        return (await self.list_configs()).get(email)
+
     def _generate_config(self, uuid: str, port: int, email: str) -> str:
         """Генерация конфига VLESS Reality"""
         return (
-            f"vless://{uuid}@{Config.SERVER_IP}:{port}?"
+            f"vless://{uuid}@{self.server_ip}:{port}?"
             f"type=tcp&security=reality&"
-            f"pbk={Config.PUBLIC_KEY}&"
-            f"sni={random.choice(Config.SERVER_NAMES)}&"
-            f"sid={Config.SHORT_ID}&"
+            f"pbk={self.public_key}&"
+            f"sni={random.choice(self.server_names)}&"
+            f"sid={self.short_id}&"
             f"flow={Config.DEFAULT_FLOW}#{email}"
         )
 
-    def _generate_qr_code(self, config_text: str) -> io.BytesIO:
-        """Генерация QR-кода из конфига"""
-        try:
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(config_text)
-            qr.make(fit=True)
-            
-            img = qr.make_image(fill_color="black", back_color="white")
-            byte_io = io.BytesIO()
-            img.save(byte_io, 'PNG')
-            byte_io.seek(0)
-            return byte_io
-        except Exception as e:
-            logger.error(f"Ошибка генерации QR-кода: {str(e)}")
-            raise XUIError(f"Ошибка генерации QR-кода: {str(e)}")
-
     async def delete_inbound(self, inbound_id: int) -> bool:
         """Удаление inbound"""
         try:
-            await self._login()
-            response = await self.session.post(
-                f"{self.base_url}/panel/api/inbounds/del/{inbound_id}",
-                follow_redirects=True
-            )
+            response = await self._request("POST", f"/panel/api/inbounds/del/{inbound_id}", idempotent=True)
             return response.status_code == 200
+        except XUIUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error deleting inbound: {str(e)}")
             raise XUIError(f"Ошибка удаления inbound: {str(e)}")
 
+    async def delete_client(self, inbound_id: int, client_id: str) -> bool:
+        """Удаление клиента из общего inbound"""
+        try:
+            response = await self._request(
+                "POST", f"/panel/api/inbounds/{inbound_id}/delClient/{client_id}", idempotent=True
+            )
+            if response.status_code != 200:
+                return False
+            if inbound_id in self._shared_inbounds:
+                self._shared_inbounds[inbound_id]["clients"] -= 1
+            return True
+        except XUIUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error deleting client: {str(e)}")
+            raise XUIError(f"Ошибка удаления клиента: {str(e)}")
+
+    async def remove_config(self, config) -> bool:
+        """Удаление конфига на панели: клиента общего inbound или отдельного inbound"""
+        if config["client_id"]:
+            return await self.delete_client(config["inbound_id"], config["client_id"])
+        return await self.delete_inbound(config["inbound_id"])
+
+    async def warm_up(self) -> None:
+        """Вход в панель заранее, чтобы первый запрос пользователя не ждал логина и TLS"""
+        if not self._authenticated:
+            await self._ensure_session(self._session_generation)
+            return
+        # Сессия восстановлена из файла: достаточно открыть соединение
+        try:
+            await self.session.get(f"{self.base_url}/")
+        except httpx.TransportError as e:
+            raise XUIError(f"Ошибка подключения: {str(e)}")
+
     async def close(self):
         """Закрытие сессии"""
-        await self.session.aclose()
+        if self._session is not None:
+            await self._session.aclose()